@@ -0,0 +1,193 @@
+import os
+import asyncio
+from aiogram.utils.exceptions import MessageNotModified, BotBlocked, UserDeactivated
+from outbound import set_priority, BROADCAST, ChatUnavailable
+from database import (
+    iter_user_ids,
+    get_user_count,
+    create_broadcast,
+    save_broadcast_progress,
+    get_running_broadcasts,
+    mark_user_status,
+)
+
+# ==== SOZLAMALAR ====
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))          # xabar / soniya (umumiy cheklov ichida)
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "10"))
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "500"))          # checkpoint oralig‘i
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "10"))
+BROADCAST_DB_BACKOFF_MAX = float(os.getenv("BROADCAST_DB_BACKOFF_MAX", "60"))  # baza xatosida kutish chegarasi
+
+# broadcast_id -> Broadcast (bir xil ish ikki marta ishga tushmasin)
+_running = {}
+
+
+class RateLimiter:
+    """Broadcast uchun qo‘shimcha cheklov: chaqiruvlar orasida kamida 1/rate soniya."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+
+    async def wait(self):
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class Broadcast:
+    """
+    Kanal postini barcha foydalanuvchilarga forward qiladi.
+    Foydalanuvchilar `user_id` tartibida partiyalab yuboriladi, har bir
+    partiyadan keyin oxirgi user_id bazaga yoziladi — qayta ishga
+    tushganda shu joydan davom etadi.
+    """
+
+    def __init__(self, bot, job: dict):
+        self.bot = bot
+        self.id = job["id"]
+        self.from_chat = job["from_chat"]
+        self.message_id = job["message_id"]
+        self.admin_chat_id = job["admin_chat_id"]
+        self.last_user_id = job["last_user_id"] or 0
+        self.sent = job["sent"] or 0
+        self.failed = job["failed"] or 0
+        self.total = job["total"] or 0
+        self.active_days = job.get("active_days")
+        self.limiter = RateLimiter(BROADCAST_RATE)
+        self._progress_message = None
+        self._db_error = None  # baza bilan aloqa uzilganda progressda ko‘rsatiladi
+        self._started = 0.0
+        self._done_at_start = self.sent + self.failed
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+    async def _send(self, user_id):
+        # RetryAfter va tarmoq xatolari OutboundBot ichida qayta uriniladi
+        await self.limiter.wait()
+        try:
+            await self.bot.forward_message(user_id, self.from_chat, self.message_id)
+            self.sent += 1
+        except Exception as e:
+            self.failed += 1
+            reason = e.reason if isinstance(e, ChatUnavailable) else e
+            if isinstance(reason, BotBlocked):
+                mark_user_status(user_id, "blocked")
+            elif isinstance(reason, UserDeactivated):
+                mark_user_status(user_id, "deactivated")
+            else:
+                print(f"[broadcast] {user_id} -> {e}")
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            try:
+                user_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await self._send(user_id)
+
+    async def _run_batch(self, batch):
+        queue = asyncio.Queue()
+        for user_id in batch:
+            queue.put_nowait(user_id)
+        workers = min(BROADCAST_WORKERS, len(batch))
+        await asyncio.gather(*(self._worker(queue) for _ in range(workers)))
+        self.last_user_id = batch[-1]
+        await save_broadcast_progress(self.id, self.last_user_id, self.sent, self.failed)
+
+    def _progress_text(self, finished=False):
+        percent = self.done * 100 / self.total if self.total else 100
+        segment = f" (oxirgi {self.active_days} kun)" if self.active_days else ""
+        text = (
+            f"📢 Habar yuborish #{self.id}{segment}\n\n"
+            f"✅ Yuborildi: {self.sent} ta\n"
+            f"❌ Xatolik: {self.failed} ta\n"
+            f"📊 {self.done}/{self.total} ({percent:.1f}%)"
+        )
+        if finished:
+            return text + "\n\n🏁 Yakunlandi"
+        if self._db_error:
+            text += f"\n⚠️ Baza xatosi, qayta urinilmoqda: {self._db_error}"
+        elapsed = asyncio.get_running_loop().time() - self._started
+        speed = (self.done - self._done_at_start) / elapsed if elapsed > 0 else 0
+        if speed > 0 and self.total > self.done:
+            eta = int((self.total - self.done) / speed)
+            text += f"\n⏳ Taxminan: {eta // 60} daq {eta % 60} s"
+        return text
+
+    async def _report(self, finished=False):
+        text = self._progress_text(finished)
+        try:
+            if self._progress_message is None:
+                self._progress_message = await self.bot.send_message(self.admin_chat_id, text)
+            else:
+                await self._progress_message.edit_text(text)
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            print(f"[broadcast] progress -> {e}")
+
+    async def _reporter(self):
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            await self._report()
+
+    async def run(self):
+        set_priority(BROADCAST)  # boshqa barcha yuborishlardan keyin
+        self._started = asyncio.get_running_loop().time()
+        await self._report()
+        reporter = asyncio.create_task(self._reporter())
+        try:
+            await self._run_with_retry()
+        finally:
+            reporter.cancel()
+            _running.pop(self.id, None)
+        await self._report(finished=True)
+
+    async def _run_with_retry(self):
+        """
+        Baza xatosida (masalan, qayta ulanish oynasida) to‘xtamaydi: kutib,
+        oxirgi yuborilgan `user_id` dan davom etadi. Yuborilgan partiya qayta yuborilmaydi.
+        """
+        delay = 1.0
+        while True:
+            try:
+                async for batch in iter_user_ids(BROADCAST_BATCH, after=self.last_user_id,
+                                                 active_days=self.active_days):
+                    await self._run_batch(batch)
+                    self._db_error = None
+                    delay = 1.0
+                await save_broadcast_progress(self.id, self.last_user_id, self.sent, self.failed, "done")
+                return
+            except Exception as e:
+                print(f"[broadcast] #{self.id} baza xatosi, {delay:.0f} s dan keyin davom etadi: {e}")
+                self._db_error = str(e) or type(e).__name__
+                await self._report()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, BROADCAST_DB_BACKOFF_MAX)
+
+
+def _start(bot, job):
+    if job["id"] in _running:
+        return _running[job["id"]]
+    broadcast = Broadcast(bot, job)
+    _running[job["id"]] = broadcast
+    asyncio.create_task(broadcast.run())
+    return broadcast
+
+
+async def start_broadcast(bot, from_chat, message_id, admin_chat_id, active_days=None):
+    """`active_days` berilsa, faqat oxirgi shuncha kunda faol bo‘lganlarga yuboradi."""
+    total = await get_user_count(active_days)
+    job = await create_broadcast(from_chat, message_id, admin_chat_id, total, active_days)
+    return _start(bot, job)
+
+
+async def resume_broadcasts(bot):
+    """Bot qayta ishga tushganda tugallanmagan yuborishlarni davom ettiradi."""
+    for job in await get_running_broadcasts():
+        _start(bot, job)
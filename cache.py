@@ -0,0 +1,110 @@
+import time
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+# Keshda yo‘q qiymat uchun belgi (None ham keshlanishi mumkin)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Chegaralangan LRU + TTL kesh.
+    `maxsize` dan oshsa eng eski ishlatilgan yozuv chiqarib tashlanadi,
+    `ttl` soniyadan eski yozuvlar esa o‘qishda eskirgan hisoblanadi.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class IntSet:
+    """
+    Ixcham butun sonlar to‘plami: asosiy qism tartiblangan `array('q')`
+    (har bir ID 8 bayt, 1 mln ID ~8 MB), yangi qo‘shilganlar kichik
+    `set` da turadi va `compact_at` tadan oshganda massivga qo‘shiladi.
+    """
+
+    def __init__(self, compact_at: int = 4096):
+        self.compact_at = compact_at
+        self._sorted = array("q")
+        self._recent: set[int] = set()
+
+    def _in_sorted(self, value: int) -> bool:
+        i = bisect_left(self._sorted, value)
+        return i < len(self._sorted) and self._sorted[i] == value
+
+    def __contains__(self, value: int) -> bool:
+        return value in self._recent or self._in_sorted(value)
+
+    def add(self, value: int):
+        if value in self:
+            return
+        self._recent.add(value)
+        if len(self._recent) >= self.compact_at:
+            self._compact()
+
+    def _compact(self):
+        self._sorted = array("q", heapq.merge(self._sorted, sorted(self._recent)))
+        self._recent = set()
+
+    def load(self, sorted_values: array):
+        """Tartiblangan massiv bilan almashtiradi; yuklash paytida qo‘shilganlar saqlanadi."""
+        current = list(self._sorted) + list(self._recent)
+        self._sorted = sorted_values
+        self._recent = {v for v in current if not self._in_sorted(v)}
+        self._compact()
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self),
+            "bytes": self._sorted.itemsize * len(self._sorted),
+        }
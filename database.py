@@ -1,71 +1,252 @@
 import asyncpg
 import os
-import json
 import asyncio
+import time
+from array import array
 from dotenv import load_dotenv
-from datetime import date
+from cache import TTLCache, IntSet, MISSING
 
 load_dotenv()
 
 db_pool: asyncpg.pool.Pool | None = None
 
+# === Anime kesh ===
+# Kod bo‘yicha o‘qilgan qatorlar (topilmagan kodlar ham None sifatida) saqlanadi
+anime_cache = TTLCache(
+    maxsize=int(os.getenv("ANIME_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("ANIME_CACHE_TTL", "600")),
+)
+_anime_inflight: dict[str, asyncio.Future] = {}
+_anime_version = 0  # har bir o‘zgarishda oshadi, eskirgan natija keshga yozilmaydi
+
+
+def invalidate_anime(*codes):
+    global _anime_version
+    _anime_version += 1
+    for code in codes:
+        anime_cache.pop(code)
+
+
+def get_anime_cache_stats() -> dict:
+    return anime_cache.stats()
+
+
+# Katalog (kod/nom ro‘yxati) o‘zgarganda oshadi — tayyor sahifalar eskiradi
+_catalog_version = 0
+
+
+def _bump_catalog():
+    global _catalog_version
+    _catalog_version += 1
+
+
+def get_catalog_version() -> int:
+    return _catalog_version
+
 
 # === Pool yaratish / qayta ulanish ===
+DB_HEALTH_INTERVAL = float(os.getenv("DB_HEALTH_INTERVAL", "15"))
+DB_HEALTH_TIMEOUT = float(os.getenv("DB_HEALTH_TIMEOUT", "5"))
+
+_pool_lock = asyncio.Lock()
+_schema_ready = False
+pool_stats = {
+    "reconnects": 0,
+    "degraded_seconds": 0.0,
+    "degraded_since": None,
+}
+
+
+async def _create_schema(conn):
+    # === Foydalanuvchilar ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS users_created_at_idx ON users (created_at);
+    """)
+    # Botni bloklagan / o‘chirilgan akkauntlar: status <> 'active'
+    await conn.execute("""
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'active';
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS users_inactive_idx ON users (user_id)
+        WHERE status <> 'active';
+    """)
+    # Oxirgi faollik — auditoriya bo‘yicha broadcast uchun
+    await conn.execute("""
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP;
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS users_last_seen_idx ON users (last_seen);
+    """)
+    # Kunlik ro‘yxatdan o‘tishlar — add_user har yangi foydalanuvchida oshiradi
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_signups_daily (
+            day DATE PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+    # Birinchi ishga tushishda mavjud foydalanuvchilardan to‘ldiriladi
+    await conn.execute("""
+        INSERT INTO user_signups_daily (day, count)
+        SELECT created_at::date, COUNT(*) FROM users
+        WHERE created_at IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM user_signups_daily)
+        GROUP BY 1
+        ON CONFLICT (day) DO NOTHING
+    """)
+    # === Anime kodlari ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS kino_codes (
+            code TEXT PRIMARY KEY,
+            title TEXT,
+            channel TEXT,
+            message_id INTEGER,
+            post_count INTEGER,
+            poster_file_id TEXT,
+            caption TEXT
+        );
+    """)
+    # === Qismlar: (kod, tartib raqami) bo‘yicha alohida qatorlar ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS anime_parts (
+            code TEXT NOT NULL REFERENCES kino_codes (code)
+                ON UPDATE CASCADE ON DELETE CASCADE,
+            ordinal INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (code, ordinal)
+        );
+    """)
+    # Qism turi: 'video' yoki 'document' (eski qismlarda NULL — noma’lum)
+    await conn.execute("""
+        ALTER TABLE anime_parts ADD COLUMN IF NOT EXISTS kind TEXT;
+    """)
+    await _migrate_parts_json(conn)
+    # Katalog raqamli tartibda: qisqa kod oldin, so‘ng leksik
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS kino_codes_sort_idx
+        ON kino_codes (length(code), code);
+    """)
+    # === Statistika ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS stats (
+            code TEXT PRIMARY KEY,
+            searched INTEGER DEFAULT 0,
+            viewed INTEGER DEFAULT 0
+        );
+    """)
+    # === Habar yuborish (broadcast) ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            from_chat TEXT NOT NULL,
+            message_id BIGINT NOT NULL,
+            admin_chat_id BIGINT NOT NULL,
+            last_user_id BIGINT DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'running',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    await conn.execute("""
+        ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS active_days INTEGER;
+    """)
+    # === Konkurs ishtirokchilari ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS contest_participants (
+            contest_id INTEGER NOT NULL,
+            user_id BIGINT NOT NULL,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (contest_id, user_id)
+        );
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS contest_participants_joined_idx
+        ON contest_participants (contest_id, joined_at, user_id);
+    """)
+    # Qur’a uchun tartib raqami: tasodifiy raqamlar PK emas, shu indeks orqali tekshiriladi
+    await conn.execute("""
+        ALTER TABLE contest_participants ADD COLUMN IF NOT EXISTS seq BIGSERIAL;
+    """)
+    await conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS contest_participants_seq_idx
+        ON contest_participants (contest_id, seq);
+    """)
+    # === Adminlar ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id BIGINT PRIMARY KEY
+        );
+    """)
+    # Dastlabki admin
+    default_admins = [6486825926]
+    for admin_id in default_admins:
+        await conn.execute(
+            "INSERT INTO admins (user_id) VALUES ($1) ON CONFLICT DO NOTHING",
+            admin_id
+        )
+
+
+async def _migrate_parts_json(conn):
+    """
+    Eski `kino_codes.parts_file_ids` (JSON matn) ustunini `anime_parts`
+    jadvaliga ko‘chiradi va ustunni o‘chiradi. Bir marta bajariladi.
+    """
+    exists = await conn.fetchval("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'kino_codes' AND column_name = 'parts_file_ids'
+    """)
+    if not exists:
+        return
+    async with conn.transaction():
+        await conn.execute("""
+            INSERT INTO anime_parts (code, ordinal, file_id)
+            SELECT k.code, p.ordinal, p.file_id
+            FROM kino_codes k,
+                 jsonb_array_elements_text(k.parts_file_ids::jsonb)
+                     WITH ORDINALITY AS p(file_id, ordinal)
+            WHERE k.parts_file_ids LIKE '[%'
+            ON CONFLICT DO NOTHING
+        """)
+        await conn.execute("""
+            UPDATE kino_codes k
+            SET post_count = (SELECT COUNT(*) FROM anime_parts p WHERE p.code = k.code)
+        """)
+        await conn.execute("ALTER TABLE kino_codes DROP COLUMN parts_file_ids")
+    print("[DB] Qismlar anime_parts jadvaliga ko‘chirildi")
+
+
 async def init_db(retries: int = 5, delay: int = 2):
     """
     PostgreSQL bilan ulanishni yaratadi.
     Ulanish xatosida `retries` marta qayta urinadi.
+    Yangi pool tayyor bo‘lgachgina eskisining o‘rniga qo‘yiladi.
     """
-    global db_pool
+    global db_pool, _schema_ready
     for i in range(retries):
         try:
-            db_pool = await asyncpg.create_pool(
+            pool = await asyncpg.create_pool(
                 dsn=os.getenv("DATABASE_URL"),
                 ssl="require",
                 statement_cache_size=0
             )
-            async with db_pool.acquire() as conn:
-                # === Foydalanuvchilar ===
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        user_id BIGINT PRIMARY KEY,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
-                # === Anime kodlari ===
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS kino_codes (
-                        code TEXT PRIMARY KEY,
-                        title TEXT,
-                        channel TEXT,
-                        message_id INTEGER,
-                        post_count INTEGER,
-                        poster_file_id TEXT,
-                        caption TEXT,
-                        parts_file_ids TEXT
-                    );
-                """)
-                # === Statistika ===
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS stats (
-                        code TEXT PRIMARY KEY,
-                        searched INTEGER DEFAULT 0,
-                        viewed INTEGER DEFAULT 0
-                    );
-                """)
-                # === Adminlar ===
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS admins (
-                        user_id BIGINT PRIMARY KEY
-                    );
-                """)
-                # Dastlabki admin
-                default_admins = [6486825926]
-                for admin_id in default_admins:
-                    await conn.execute(
-                        "INSERT INTO admins (user_id) VALUES ($1) ON CONFLICT DO NOTHING",
-                        admin_id
-                    )
+            if not _schema_ready:
+                try:
+                    async with pool.acquire() as conn:
+                        await _create_schema(conn)
+                except Exception:
+                    pool.terminate()
+                    raise
+                _schema_ready = True
+            old_pool, db_pool = db_pool, pool
+            if old_pool is not None:
+                asyncio.create_task(_close_pool(old_pool))
             print("[DB] Ulanish muvaffaqiyatli")
             break
         except Exception as e:
@@ -75,97 +256,403 @@ async def init_db(retries: int = 5, delay: int = 2):
             await asyncio.sleep(delay)
 
 
+async def _close_pool(pool):
+    try:
+        await asyncio.wait_for(pool.close(), timeout=DB_HEALTH_TIMEOUT)
+    except Exception:
+        pool.terminate()
+
+
+async def reconnect(failed_pool=None):
+    """
+    Bitta qulf ostida qayta ulanadi. Agar boshqa chaqiruv poolni
+    allaqachon almashtirgan bo‘lsa, qaytadan ulanmaydi.
+    """
+    async with _pool_lock:
+        if db_pool is not None and db_pool is not failed_pool:
+            return
+        await init_db()
+        if failed_pool is not None:
+            pool_stats["reconnects"] += 1
+
+
 async def get_conn() -> asyncpg.pool.Pool:
     """
-    Har safar ishlashdan oldin poolni tekshiradi.
-    Ulanish uzilgan bo‘lsa qayta ulanadi.
+    Joriy poolni tekshiruvsiz qaytaradi.
+    Pool holatini `pool_supervisor` kuzatib boradi.
     """
-    global db_pool
     if db_pool is None:
-        await init_db()
-        return db_pool
-    try:
-        async with db_pool.acquire() as conn:
-            await conn.execute("SELECT 1;")
-    except (asyncpg.InterfaceError, asyncpg.PostgresError):
-        print("[DB] Pool uzildi, qayta ulanmoqda…")
-        await init_db()
+        await reconnect()
     return db_pool
 
 
+def _mark_degraded(degraded: bool):
+    now = asyncio.get_running_loop().time()
+    since = pool_stats["degraded_since"]
+    if degraded and since is None:
+        pool_stats["degraded_since"] = now
+    elif not degraded and since is not None:
+        pool_stats["degraded_seconds"] += now - since
+        pool_stats["degraded_since"] = None
+
+
+async def pool_supervisor():
+    """
+    Har `DB_HEALTH_INTERVAL` soniyada poolni tekshiradi,
+    uzilgan bo‘lsa qayta ulanadi.
+    """
+    while True:
+        await asyncio.sleep(DB_HEALTH_INTERVAL)
+        pool = db_pool
+        try:
+            async with pool.acquire(timeout=DB_HEALTH_TIMEOUT) as conn:
+                await conn.execute("SELECT 1;", timeout=DB_HEALTH_TIMEOUT)
+            _mark_degraded(False)
+        except Exception as e:
+            print(f"[DB] Pool uzildi, qayta ulanmoqda… ({e})")
+            _mark_degraded(True)
+            try:
+                await reconnect(pool)
+                _mark_degraded(False)
+            except Exception as e:
+                print(f"[DB] Qayta ulanib bo‘lmadi: {e}")
+
+
+async def close_db():
+    """To‘xtashda buferdagi ma'lumotlarni yozib, poolni yopadi."""
+    global db_pool
+    await flush_buffers()
+    if db_pool is not None:
+        await _close_pool(db_pool)
+        db_pool = None
+
+
+def get_pool_stats() -> dict:
+    degraded = pool_stats["degraded_seconds"]
+    since = pool_stats["degraded_since"]
+    if since is not None:
+        degraded += asyncio.get_running_loop().time() - since
+    return {
+        "reconnects": pool_stats["reconnects"],
+        "degraded_seconds": degraded,
+        "degraded": since is not None,
+    }
+
+
 # === Foydalanuvchilar ===
-async def add_user(user_id):
+# Bazadagi barcha user_id lar xotirada ixcham saqlanadi: qayta /start bosgan
+# foydalanuvchi bazaga umuman murojaat qilmaydi, yangilari esa partiyalab yoziladi.
+known_users = IntSet()
+_new_users: set[int] = set()
+
+
+def add_user(user_id: int):
+    """Foydalanuvchini yozish navbatiga qo‘shadi (agar hali ma’lum bo‘lmasa)."""
+    if user_id in known_users:
+        return
+    known_users.add(user_id)
+    _new_users.add(user_id)
+    _status_buffer.pop(user_id, None)
+
+
+async def load_known_users():
+    """Ma’lum foydalanuvchilar to‘plamini bazadan to‘ldiradi (ishga tushganda)."""
+    ids = array("q")
+    try:
+        async for batch in iter_user_ids(10000, include_inactive=True):
+            ids.extend(batch)
+    except Exception as e:
+        print(f"[DB] Foydalanuvchilarni yuklashda xatolik: {e}")
+        return
+    known_users.load(ids)
+    print(f"[DB] {len(ids)} ta foydalanuvchi xotiraga yuklandi.")
+
+
+async def flush_new_users():
+    """Yangi foydalanuvchilarni bitta so‘rovda yozadi, kunlik hisobni ham yangilaydi."""
+    global _new_users
+    if not _new_users:
+        return
+    batch, _new_users = _new_users, set()
+    try:
+        pool = await get_conn()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                WITH upsert AS (
+                    INSERT INTO users (user_id, last_seen)
+                    SELECT u, CURRENT_TIMESTAMP FROM unnest($1::bigint[]) AS u
+                    ON CONFLICT (user_id) DO UPDATE SET status = 'active'
+                        WHERE users.status <> 'active'
+                    RETURNING created_at, (xmax = 0) AS inserted
+                )
+                INSERT INTO user_signups_daily (day, count)
+                SELECT created_at::date, COUNT(*) FROM upsert WHERE inserted
+                GROUP BY 1
+                ON CONFLICT (day) DO UPDATE SET count = user_signups_daily.count + EXCLUDED.count
+            """, sorted(batch))
+    except Exception as e:
+        print(f"[DB] Yangi foydalanuvchilarni yozishda xatolik: {e}")
+        _new_users |= batch
+
+
+def get_known_users_stats() -> dict:
+    return {**known_users.stats(), "pending": len(_new_users)}
+
+
+# === Nofaol foydalanuvchilar ===
+# Broadcast paytidagi doimiy xatolar xotirada yig‘ilib, partiyalab yoziladi
+USER_STATUSES = ("active", "blocked", "deactivated")
+_status_buffer: dict[int, str] = {}
+
+
+def mark_user_status(user_id: int, status: str):
+    if status in USER_STATUSES:
+        _status_buffer[user_id] = status
+
+
+async def flush_user_status():
+    global _status_buffer
+    if not _status_buffer:
+        return
+    batch, _status_buffer = _status_buffer, {}
+    user_ids = sorted(batch)
+    try:
+        pool = await get_conn()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE users u SET status = v.status
+                FROM unnest($1::bigint[], $2::text[]) AS v(user_id, status)
+                WHERE u.user_id = v.user_id AND u.status <> v.status
+            """, user_ids, [batch[uid] for uid in user_ids])
+    except Exception as e:
+        print(f"[DB] Foydalanuvchi holatini yozishda xatolik: {e}")
+        for uid, status in batch.items():
+            _status_buffer.setdefault(uid, status)
+
+
+# === Oxirgi faollik ===
+# Har bir xabar faqat xotiradagi to‘plamga tushadi; bir oynadagi ko‘p
+# xabarlar bitta UPDATE bo‘lib yoziladi.
+_seen_buffer: set[int] = set()
+
+
+def touch_user(user_id: int):
+    _seen_buffer.add(user_id)
+    # Bot bilan yozishayotgan foydalanuvchi bloklamagan
+    _status_buffer.pop(user_id, None)
+
+
+async def flush_last_seen():
+    global _seen_buffer
+    if not _seen_buffer:
+        return
+    batch, _seen_buffer = _seen_buffer, set()
+    try:
+        pool = await get_conn()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE users SET last_seen = CURRENT_TIMESTAMP, status = 'active'
+                WHERE user_id = ANY($1::bigint[])
+            """, sorted(batch))
+    except Exception as e:
+        print(f"[DB] Faollikni yozishda xatolik: {e}")
+        _seen_buffer |= batch
+
+
+async def get_user_count(active_days: int | None = None):
+    """
+    Faol foydalanuvchilar soni (bloklaganlar hisobga olinmaydi).
+    `active_days` berilsa — oxirgi shuncha kunda botdan foydalanganlar.
+    """
     pool = await get_conn()
     async with pool.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO users (user_id) VALUES ($1) ON CONFLICT DO NOTHING", user_id
-        )
+        if active_days:
+            row = await conn.fetchrow("""
+                SELECT COUNT(*) FROM users
+                WHERE last_seen >= CURRENT_TIMESTAMP - make_interval(days => $1)
+                  AND status = 'active'
+            """, active_days)
+        else:
+            row = await conn.fetchrow("""
+                SELECT (SELECT COALESCE(SUM(count), 0) FROM user_signups_daily)
+                     - (SELECT COUNT(*) FROM users WHERE status <> 'active')
+            """)
+        return row[0]
+
+# === Admin paneli statistikasi ===
+DASHBOARD_TTL = float(os.getenv("DASHBOARD_TTL", "30"))
+_dashboard_cache = TTLCache(maxsize=1, ttl=DASHBOARD_TTL)
 
-async def get_user_count():
+
+async def get_dashboard() -> dict:
+    """
+    Asosiy ko‘rsatkichlar bitta so‘rovda, kunlik qator `get_signup_series` dan.
+    Natija `DASHBOARD_TTL` soniya keshlanadi.
+    """
+    cached = _dashboard_cache.get("dashboard")
+    if cached is not MISSING:
+        return cached
     pool = await get_conn()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT COUNT(*) FROM users")
-        return row[0]
+        start = time.perf_counter()
+        row = await conn.fetchrow("""
+            SELECT
+                (SELECT COALESCE(SUM(count), 0) FROM user_signups_daily) AS all_users,
+                (SELECT COUNT(*) FROM users WHERE status <> 'active') AS inactive_users,
+                (SELECT COUNT(*) FROM kino_codes) AS codes,
+                COALESCE(SUM(count) FILTER (WHERE day = CURRENT_DATE), 0) AS today_users,
+                COALESCE(SUM(count) FILTER (WHERE day > CURRENT_DATE - 7), 0) AS week_users,
+                COALESCE(SUM(count), 0) AS month_users
+            FROM user_signups_daily
+            WHERE day > CURRENT_DATE - 30
+        """)
+        ping = (time.perf_counter() - start) * 1000
+    data = dict(row)
+    data["users"] = data["all_users"] - data["inactive_users"]
+    data["last_7_days"] = [count for _, count in await get_signup_series(7)]
+    data["ping_ms"] = ping
+    _dashboard_cache.set("dashboard", data)
+    return data
+
 
 async def get_today_users():
     pool = await get_conn()
     async with pool.acquire() as conn:
-        today = date.today()
-        row = await conn.fetchrow("""
-            SELECT COUNT(*) FROM users WHERE DATE(created_at) = $1
-        """, today)
+        row = await conn.fetchrow(
+            "SELECT count FROM user_signups_daily WHERE day = CURRENT_DATE"
+        )
         return row[0] if row else 0
 
 
+async def get_signup_series(days: int = 30):
+    """Oxirgi `days` kun uchun (kun, soni) ro‘yxati, bo‘sh kunlar 0 bilan."""
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT d::date AS day, COALESCE(s.count, 0) AS count
+            FROM generate_series(CURRENT_DATE - ($1::int - 1), CURRENT_DATE, '1 day') AS d
+            LEFT JOIN user_signups_daily s ON s.day = d::date
+            ORDER BY d
+        """, days)
+        return [(row["day"], row["count"]) for row in rows]
+
+
 # === Anime kodlari ===
-async def add_anime(code, title, poster_file_id, parts_file_ids, caption=""):
+async def add_anime(code, title, poster_file_id, parts_file_ids, caption="", parts_kinds=None):
     pool = await get_conn()
     async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO kino_codes (code, title, poster_file_id, caption, parts_file_ids, post_count)
-            VALUES ($1, $2, $3, $4, $5, $6)
-            ON CONFLICT (code) DO UPDATE SET
-                title = EXCLUDED.title,
-                poster_file_id = EXCLUDED.poster_file_id,
-                caption = EXCLUDED.caption,
-                parts_file_ids = EXCLUDED.parts_file_ids;
-        """, code, title, poster_file_id, caption, json.dumps(parts_file_ids), len(parts_file_ids))
-        await conn.execute("""
-            INSERT INTO stats (code) VALUES ($1)
-            ON CONFLICT DO NOTHING
-        """, code)
+        async with conn.transaction():
+            await conn.execute("""
+                INSERT INTO kino_codes (code, title, poster_file_id, caption, post_count)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (code) DO UPDATE SET
+                    title = EXCLUDED.title,
+                    poster_file_id = EXCLUDED.poster_file_id,
+                    caption = EXCLUDED.caption,
+                    post_count = EXCLUDED.post_count;
+            """, code, title, poster_file_id, caption, len(parts_file_ids))
+            await conn.execute("DELETE FROM anime_parts WHERE code = $1", code)
+            await conn.execute("""
+                INSERT INTO anime_parts (code, ordinal, file_id, kind)
+                SELECT $1, p.ordinal, p.file_id, p.kind
+                FROM unnest($2::text[], $3::text[]) WITH ORDINALITY AS p(file_id, kind, ordinal)
+            """, code, list(parts_file_ids), list(parts_kinds or [None] * len(parts_file_ids)))
+            await conn.execute("""
+                INSERT INTO stats (code) VALUES ($1)
+                ON CONFLICT DO NOTHING
+            """, code)
+    invalidate_anime(code)
+    _bump_catalog()
 
 
 async def get_kino_by_code(code):
+    """
+    Avval keshdan qaraydi. Bir vaqtda kelgan bir xil so‘rovlar
+    bazaga bitta so‘rov bilan boradi.
+    """
+    cached = anime_cache.get(code)
+    if cached is not MISSING:
+        return _copy_kino(cached)
+
+    fut = _anime_inflight.get(code)
+    if fut is not None:
+        return _copy_kino(await asyncio.shield(fut))
+
+    fut = asyncio.get_running_loop().create_future()
+    _anime_inflight[code] = fut
+    version = _anime_version
+    try:
+        data = await _fetch_kino_by_code(code)
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # kutuvchi bo‘lmasa ham ogohlantirish chiqmasin
+        raise
+    except BaseException:
+        fut.cancel()
+        raise
+    finally:
+        _anime_inflight.pop(code, None)
+    if version == _anime_version:
+        anime_cache.set(code, data)
+    fut.set_result(data)
+    return _copy_kino(data)
+
+
+def _copy_kino(data):
+    if data is None:
+        return None
+    item = dict(data)
+    item["parts_file_ids"] = list(item["parts_file_ids"])
+    item["parts_kinds"] = list(item["parts_kinds"])
+    return item
+
+
+# Qismlar bazaning o‘zida massivga yig‘iladi, asyncpg uni ro‘yxatga aylantiradi
+_KINO_COLUMNS = """
+    k.code, k.title, k.poster_file_id, k.caption,
+    ARRAY(SELECT p.file_id FROM anime_parts p
+          WHERE p.code = k.code ORDER BY p.ordinal) AS parts_file_ids,
+    ARRAY(SELECT p.kind FROM anime_parts p
+          WHERE p.code = k.code ORDER BY p.ordinal) AS parts_kinds,
+    k.post_count, k.channel, k.message_id
+"""
+
+
+async def _fetch_kino_by_code(code):
     pool = await get_conn()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("""
-            SELECT code, title, poster_file_id, caption, parts_file_ids,
-                   post_count, channel, message_id
-            FROM kino_codes
-            WHERE code = $1
+        row = await conn.fetchrow(f"""
+            SELECT {_KINO_COLUMNS}
+            FROM kino_codes k
+            WHERE k.code = $1
         """, code)
-        if row:
-            data = dict(row)
-            data["parts_file_ids"] = json.loads(data["parts_file_ids"]) if data.get("parts_file_ids") else []
-            return data
-        return None
+        return dict(row) if row else None
 
 
-async def get_all_codes():
+async def get_catalog_page(offset: int, limit: int):
+    """
+    Faqat kod va nomni tartiblangan holda qaytaradi.
+    Natija: (qatorlar, jami soni).
+    """
+    # Jami son alohida: oynali COUNT har safar butun jadvalni o‘qiydi
+    total = await get_codes_count()
+    if not total:
+        return [], 0
     pool = await get_conn()
     async with pool.acquire() as conn:
         rows = await conn.fetch("""
-            SELECT code, title, poster_file_id, caption, parts_file_ids,
-                   post_count, channel, message_id
+            SELECT code, title
             FROM kino_codes
-        """)
-        result = []
-        for row in rows:
-            item = dict(row)
-            item["parts_file_ids"] = json.loads(item["parts_file_ids"]) if item.get("parts_file_ids") else []
-            result.append(item)
-        return result
+            ORDER BY length(code), code
+            LIMIT $1 OFFSET $2
+        """, limit, offset)
+    return [(row["code"], row["title"]) for row in rows], total
+
+
+async def get_codes_count():
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        return await conn.fetchval("SELECT COUNT(*) FROM kino_codes")
 
 
 async def delete_kino_code(code):
@@ -173,31 +660,85 @@ async def delete_kino_code(code):
     async with pool.acquire() as conn:
         await conn.execute("DELETE FROM stats WHERE code = $1", code)
         result = await conn.execute("DELETE FROM kino_codes WHERE code = $1", code)
-        return result.endswith("1")
+    invalidate_anime(code)
+    _bump_catalog()
+    return result.endswith("1")
 
 
 # === Statistika ===
+# Hisoblagichlar xotirada yig‘iladi va har `STATS_FLUSH_INTERVAL` soniyada
+# bitta so‘rov bilan bazaga yoziladi.
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "2"))
+STATS_BUFFER_MAX = int(os.getenv("STATS_BUFFER_MAX", "5000"))
+
+_stats_buffer: dict[str, list[int]] = {}  # code -> [searched, viewed]
+_stats_flush_lock = asyncio.Lock()
+
+
 async def increment_stat(code, field):
     if field not in ("searched", "viewed", "init"):
         return
-    pool = await get_conn()
-    async with pool.acquire() as conn:
-        if field == "init":
-            await conn.execute("""
-                INSERT INTO stats (code, searched, viewed) VALUES ($1, 0, 0)
-                ON CONFLICT DO NOTHING
-            """, code)
-        else:
-            await conn.execute(f"""
-                UPDATE stats SET {field} = {field} + 1 WHERE code = $1
-            """, code)
+    counters = _stats_buffer.setdefault(code, [0, 0])
+    if field == "searched":
+        counters[0] += 1
+    elif field == "viewed":
+        counters[1] += 1
+    if len(_stats_buffer) >= STATS_BUFFER_MAX and not _stats_flush_lock.locked():
+        asyncio.create_task(flush_stats())
+
+
+async def flush_stats():
+    global _stats_buffer
+    async with _stats_flush_lock:
+        if not _stats_buffer:
+            return
+        batch, _stats_buffer = _stats_buffer, {}
+        codes = sorted(batch)  # bir xil tartib — qatorlar bir-birini bloklamaydi
+        try:
+            pool = await get_conn()
+            async with pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO stats (code, searched, viewed)
+                    SELECT * FROM unnest($1::text[], $2::int[], $3::int[])
+                    ON CONFLICT (code) DO UPDATE SET
+                        searched = stats.searched + EXCLUDED.searched,
+                        viewed = stats.viewed + EXCLUDED.viewed
+                """, codes, [batch[c][0] for c in codes], [batch[c][1] for c in codes])
+        except Exception as e:
+            print(f"[DB] Statistikani yozishda xatolik: {e}")
+            # Yozilmagan qiymatlar keyingi safar qayta yoziladi
+            for code, (searched, viewed) in batch.items():
+                counters = _stats_buffer.setdefault(code, [0, 0])
+                counters[0] += searched
+                counters[1] += viewed
+
+
+async def flush_buffers():
+    await flush_stats()
+    await flush_new_users()  # last_seen yangilanishidan oldin qator mavjud bo‘lsin
+    # last_seen status='active' qiladi; undan keyin kelgan blok belgisi ustidan yozilsin
+    await flush_last_seen()
+    await flush_user_status()
+
+
+async def buffer_flusher():
+    """Xotiradagi barcha buferlarni vaqti-vaqti bilan bazaga yozadi."""
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        await flush_buffers()
+
 
 async def get_code_stat(code):
     pool = await get_conn()
     async with pool.acquire() as conn:
-        return await conn.fetchrow(
+        row = await conn.fetchrow(
             "SELECT searched, viewed FROM stats WHERE code = $1", code
         )
+    pending = _stats_buffer.get(code)
+    if pending is None:
+        return row
+    searched, viewed = (row["searched"], row["viewed"]) if row else (0, 0)
+    return {"searched": searched + pending[0], "viewed": viewed + pending[1]}
 
 
 # === Kodni yangilash ===
@@ -207,15 +748,38 @@ async def update_anime_code(old_code, new_code, new_title):
         await conn.execute("""
             UPDATE kino_codes SET code = $1, title = $2 WHERE code = $3
         """, new_code, new_title, old_code)
+    invalidate_anime(old_code, new_code)
+    _bump_catalog()
 
 
 # === Adminlar ===
+# Yagona xotiradagi adminlar to‘plami: main.ADMINS, IsAdmin va konkurs
+# shu obyektning o‘zidan foydalanadi. Boshqa nusxalardagi o‘zgarishlar
+# Postgres NOTIFY orqali keladi.
+admin_ids: set[int] = set()
+ADMINS_CHANNEL = "admins_changed"
+ADMINS_LISTEN_CHECK = float(os.getenv("ADMINS_LISTEN_CHECK", "30"))
+
+
 async def get_all_admins():
     pool = await get_conn()
     async with pool.acquire() as conn:
         rows = await conn.fetch("SELECT user_id FROM admins")
         return {row["user_id"] for row in rows}
 
+async def load_admins(seed=()):
+    """Boshlang‘ich adminlarni qo‘shib, ro‘yxatni bazadan yuklaydi."""
+    if seed:
+        pool = await get_conn()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO admins (user_id) SELECT unnest($1::bigint[])
+                ON CONFLICT DO NOTHING
+            """, list(seed))
+    admins = await get_all_admins()
+    admin_ids.clear()
+    admin_ids.update(admins)
+
 async def add_admin(user_id: int):
     pool = await get_conn()
     async with pool.acquire() as conn:
@@ -223,47 +787,269 @@ async def add_admin(user_id: int):
             "INSERT INTO admins (user_id) VALUES ($1) ON CONFLICT DO NOTHING",
             user_id
         )
+        await conn.execute(f"NOTIFY {ADMINS_CHANNEL}")
+    admin_ids.add(user_id)
 
 async def remove_admin(user_id: int):
     pool = await get_conn()
     async with pool.acquire() as conn:
         await conn.execute("DELETE FROM admins WHERE user_id = $1", user_id)
+        await conn.execute(f"NOTIFY {ADMINS_CHANNEL}")
+    admin_ids.discard(user_id)
+
+
+def _on_admins_changed(conn, pid, channel, payload):
+    asyncio.create_task(load_admins())
+
+
+async def admins_listener():
+    """
+    Alohida ulanishda LISTEN qiladi. Ulanish uzilsa qayta ulanadi va
+    o‘tkazib yuborilgan o‘zgarishlar uchun ro‘yxatni qayta yuklaydi.
+    """
+    conn = None
+    while True:
+        try:
+            if conn is None or conn.is_closed():
+                conn = await asyncpg.connect(dsn=os.getenv("DATABASE_URL"), ssl="require")
+                await conn.add_listener(ADMINS_CHANNEL, _on_admins_changed)
+                await load_admins()
+        except Exception as e:
+            print(f"[DB] Adminlar kanaliga ulanib bo‘lmadi: {e}")
+            conn = None
+        await asyncio.sleep(ADMINS_LISTEN_CHECK)
 
 
 # === Barcha foydalanuvchilarni olish ===
-async def get_all_user_ids():
+async def get_all_user_ids(active_days: int | None = None, include_inactive: bool = False):
+    """Nofaollar (bloklagan / o‘chirilgan) sukut bo‘yicha chiqarilmaydi."""
     pool = await get_conn()
     async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT user_id FROM users")
+        rows = await conn.fetch("""
+            SELECT user_id FROM users
+            WHERE ($2 OR status = 'active')
+              AND ($1::int IS NULL
+                   OR last_seen >= CURRENT_TIMESTAMP - make_interval(days => $1))
+            ORDER BY user_id
+        """, active_days, include_inactive)
         return [row["user_id"] for row in rows]
 
 
+async def iter_user_ids(batch_size: int = 1000, after: int = 0,
+                        created_from=None, created_to=None,
+                        include_inactive: bool = False,
+                        active_days: int | None = None):
+    """
+    Foydalanuvchi ID larini `user_id` bo‘yicha keyset-sahifalab,
+    `batch_size` tadan ro‘yxat ko‘rinishida qaytaradi.
+    Xotira jadval hajmiga bog‘liq emas. Nofaollar sukut bo‘yicha chiqarilmaydi.
+    `active_days` — faqat oxirgi shuncha kunda faol bo‘lganlar.
+    """
+    while True:
+        pool = await get_conn()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT user_id FROM users
+                WHERE user_id > $1
+                  AND ($2::timestamp IS NULL OR created_at >= $2)
+                  AND ($3::timestamp IS NULL OR created_at < $3)
+                  AND ($5 OR status = 'active')
+                  AND ($6::int IS NULL
+                       OR last_seen >= CURRENT_TIMESTAMP - make_interval(days => $6))
+                ORDER BY user_id
+                LIMIT $4
+            """, after, created_from, created_to, batch_size, include_inactive, active_days)
+        if not rows:
+            return
+        batch = [row["user_id"] for row in rows]
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after = batch[-1]
+
+
+# === Broadcast holati ===
+async def create_broadcast(from_chat, message_id, admin_chat_id, total, active_days=None):
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            INSERT INTO broadcasts (from_chat, message_id, admin_chat_id, total, active_days)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING *
+        """, str(from_chat), message_id, admin_chat_id, total, active_days)
+        return dict(row)
+
+async def save_broadcast_progress(broadcast_id, last_user_id, sent, failed, status="running"):
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE broadcasts
+            SET last_user_id = $2, sent = $3, failed = $4, status = $5
+            WHERE id = $1
+        """, broadcast_id, last_user_id, sent, failed, status)
+
+async def get_running_broadcasts():
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [dict(row) for row in rows]
+
+
 # === Qism qo‘shish / o‘chirish ===
-async def add_part_to_anime(code: str, file_id: str):
+async def add_part_to_anime(code: str, file_id: str, kind: str | None = None):
+    """
+    Qismni oxiriga qo‘shadi. `kino_codes` qatori qulflanadi, shuning uchun
+    bir vaqtda qo‘shilgan qismlar bir-birini yo‘qotmaydi.
+    """
     pool = await get_conn()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT parts_file_ids FROM kino_codes WHERE code=$1", code)
-        parts = json.loads(row["parts_file_ids"]) if row["parts_file_ids"] else []
-        parts.append(file_id)
-        await conn.execute(
-            "UPDATE kino_codes SET parts_file_ids=$1 WHERE code=$2",
-            json.dumps(parts),
-            code
-        )
+        async with conn.transaction():
+            ordinal = await conn.fetchval("""
+                UPDATE kino_codes SET post_count = COALESCE(post_count, 0) + 1
+                WHERE code = $1
+                RETURNING post_count
+            """, code)
+            if ordinal is None:
+                return False
+            await conn.execute(
+                "INSERT INTO anime_parts (code, ordinal, file_id, kind) VALUES ($1, $2, $3, $4)",
+                code, ordinal, file_id, kind
+            )
+    invalidate_anime(code)
+    return True
 
 async def delete_part_from_anime(code: str, part_number: int):
     pool = await get_conn()
     async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT parts_file_ids FROM kino_codes WHERE code=$1", code)
-        if not row or not row["parts_file_ids"]:
-            return False
-        parts = json.loads(row["parts_file_ids"])
-        if part_number < 1 or part_number > len(parts):
-            return False
-        parts.pop(part_number - 1)  # 1-asosli → 0-asosli
-        await conn.execute(
-            "UPDATE kino_codes SET parts_file_ids=$1 WHERE code=$2",
-            json.dumps(parts),
-            code
+        async with conn.transaction():
+            found = await conn.fetchval("""
+                UPDATE kino_codes SET post_count = post_count - 1
+                WHERE code = $1 AND $2 BETWEEN 1 AND post_count
+                RETURNING 1
+            """, code, part_number)
+            if not found:
+                return False
+            await conn.execute(
+                "DELETE FROM anime_parts WHERE code = $1 AND ordinal = $2",
+                code, part_number
+            )
+            # Keyingi qismlarni bittaga suramiz (PK to‘qnashmasligi uchun ikki qadamda)
+            await conn.execute("""
+                UPDATE anime_parts SET ordinal = -(ordinal - 1)
+                WHERE code = $1 AND ordinal > $2
+            """, code, part_number)
+            await conn.execute("""
+                UPDATE anime_parts SET ordinal = -ordinal
+                WHERE code = $1 AND ordinal < 0
+            """, code)
+    invalidate_anime(code)
+    return True
+
+
+# === Konkurs ishtirokchilari ===
+async def add_contest_participant(contest_id: int, user_id: int) -> bool:
+    """Ishtirokchini qo‘shadi. Avval qo‘shilgan bo‘lsa False."""
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        # NOT EXISTS: qayta bosishda seq ketma-ketligi bekorga sarflanmasin
+        inserted = await conn.fetchval("""
+            INSERT INTO contest_participants (contest_id, user_id)
+            SELECT $1, $2
+            WHERE NOT EXISTS (
+                SELECT 1 FROM contest_participants WHERE contest_id = $1 AND user_id = $2
+            )
+            ON CONFLICT DO NOTHING
+            RETURNING 1
+        """, contest_id, user_id)
+        return inserted is not None
+
+
+async def add_contest_participants(contest_id: int, user_ids) -> int:
+    """Ko‘p ishtirokchini bitta so‘rovda qo‘shadi (JSON dan ko‘chirish uchun)."""
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        result = await conn.execute("""
+            INSERT INTO contest_participants (contest_id, user_id)
+            SELECT $1, u FROM unnest($2::bigint[]) AS u
+            ON CONFLICT DO NOTHING
+        """, contest_id, list(user_ids))
+        return int(result.split()[-1])
+
+
+async def count_contest_participants(contest_id: int) -> int:
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT COUNT(*) FROM contest_participants WHERE contest_id = $1", contest_id
         )
-        return True
+
+
+async def get_contest_participants_page(contest_id: int, limit: int,
+                                        cursor=None, backward: bool = False):
+    """
+    Qo‘shilish tartibidagi bitta sahifa, (joined_at, user_id) bo‘yicha keyset.
+    `cursor` — (joined_at, user_id): undan keyingi (yoki `backward` da oldingi) qatorlar.
+    Natija: [(user_id, joined_at), ...] o‘sish tartibida.
+    """
+    joined_at, user_id = cursor or (None, None)
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        if backward:
+            rows = await conn.fetch("""
+                SELECT user_id, joined_at FROM contest_participants
+                WHERE contest_id = $1 AND (joined_at, user_id) < ($2, $3)
+                ORDER BY joined_at DESC, user_id DESC
+                LIMIT $4
+            """, contest_id, joined_at, user_id, limit)
+            rows = rows[::-1]
+        else:
+            rows = await conn.fetch("""
+                SELECT user_id, joined_at FROM contest_participants
+                WHERE contest_id = $1
+                  AND ($2::timestamp IS NULL OR (joined_at, user_id) > ($2, $3))
+                ORDER BY joined_at, user_id
+                LIMIT $4
+            """, contest_id, joined_at, user_id, limit)
+    return [(row["user_id"], row["joined_at"]) for row in rows]
+
+
+async def iter_contest_participants(contest_id: int, batch_size: int = 1000):
+    """Ishtirokchilarni `user_id` bo‘yicha keyset-sahifalab qaytaradi (eksport uchun)."""
+    after = 0
+    while True:
+        pool = await get_conn()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT user_id, joined_at FROM contest_participants
+                WHERE contest_id = $1 AND user_id > $2
+                ORDER BY user_id
+                LIMIT $3
+            """, contest_id, after, batch_size)
+        if not rows:
+            return
+        yield [(row["user_id"], row["joined_at"]) for row in rows]
+        if len(rows) < batch_size:
+            return
+        after = rows[-1]["user_id"]
+
+
+async def get_contest_seq_range(contest_id: int):
+    """(eng kichik, eng katta) seq yoki ishtirokchi bo‘lmasa None."""
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            SELECT MIN(seq) AS lo, MAX(seq) AS hi
+            FROM contest_participants WHERE contest_id = $1
+        """, contest_id)
+    return (row["lo"], row["hi"]) if row["lo"] is not None else None
+
+
+async def get_contest_participants_by_seq(contest_id: int, seqs) -> dict:
+    """Berilgan seq raqamlaridagi ishtirokchilar: {seq: user_id} (bo‘sh raqamlar tushib qoladi)."""
+    pool = await get_conn()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT seq, user_id FROM contest_participants
+            WHERE contest_id = $1 AND seq = ANY($2::bigint[])
+        """, contest_id, list(seqs))
+        return {row["seq"]: row["user_id"] for row in rows}
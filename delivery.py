@@ -0,0 +1,83 @@
+import os
+import asyncio
+from collections import deque
+from outbound import set_priority, DELIVERY
+
+# ==== SOZLAMALAR ====
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+DELIVERY_UNIT_SIZE = 10  # bir navbatda yuboriladigan qismlar (bitta albom, Telegram cheklovi)
+
+
+class DeliveryJob:
+    def __init__(self, user_id, key, title, numbered_parts):
+        self.user_id = user_id
+        self.key = key
+        self.title = title
+        self.units = deque(
+            numbered_parts[i:i + DELIVERY_UNIT_SIZE]
+            for i in range(0, len(numbered_parts), DELIVERY_UNIT_SIZE)
+        )
+
+
+class DeliveryScheduler:
+    """
+    Qismlarni yuborish navbati.
+    Har bir foydalanuvchining o‘z navbati bor; ishchilar foydalanuvchilar
+    orasida navbatma-navbat (round-robin) bitta albomdan yuboradi.
+    Shu sababli katta yuklab olishlar boshqalarning birinchi qismini
+    kechiktirmaydi. Bir foydalanuvchining albomlari doim tartib bilan ketadi.
+    """
+
+    def __init__(self, send_unit, workers: int = DELIVERY_WORKERS):
+        self.send_unit = send_unit  # async (chat_id, title, [(raqam, qism), ...])
+        self.workers = workers
+        self._queues: dict[int, deque] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._inflight: set = set()
+        self._tasks = []
+
+    def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def submit(self, user_id, code, title, parts, first_number=1) -> bool:
+        """Ishni navbatga qo‘yadi. Xuddi shu so‘rov hali tugamagan bo‘lsa False."""
+        key = (user_id, code, first_number, first_number + len(parts) - 1)
+        if key in self._inflight or not parts:
+            return False
+        self._inflight.add(key)
+        job = DeliveryJob(user_id, key, title, list(enumerate(parts, start=first_number)))
+        queue = self._queues.get(user_id)
+        if queue is None:
+            self._queues[user_id] = deque([job])
+            self._ready.put_nowait(user_id)
+        else:
+            queue.append(job)
+        return True
+
+    async def _worker(self):
+        set_priority(DELIVERY)
+        while True:
+            user_id = await self._ready.get()
+            queue = self._queues[user_id]
+            job = queue[0]
+            unit = job.units.popleft()
+            try:
+                await self.send_unit(user_id, job.title, unit)
+            except Exception as e:
+                print(f"[delivery] {user_id} -> {e}")
+            if not job.units:
+                queue.popleft()
+                self._inflight.discard(job.key)
+            if queue:
+                self._ready.put_nowait(user_id)  # navbat oxiriga
+            else:
+                del self._queues[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._queues),
+            "jobs": sum(len(q) for q in self._queues.values()),
+            "units": sum(len(job.units) for q in self._queues.values() for job in q),
+            "workers": self.workers,
+        }
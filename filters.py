@@ -1,7 +1,7 @@
 # filters.py
 from aiogram.dispatcher.filters import BoundFilter
 from aiogram import types
-from database import get_all_admins   # sening bazadan olish funksiyang
+from database import admin_ids   # xotiradagi adminlar ro‘yxati (bazadan yuklanadi)
 
 class IsAdmin(BoundFilter):
     key = "is_admin"
@@ -10,5 +10,4 @@ class IsAdmin(BoundFilter):
         self.is_admin = is_admin
 
     async def check(self, message: types.Message) -> bool:
-        admins = await get_all_admins()
-        return message.from_user.id in admins
+        return message.from_user.id in admin_ids
@@ -1,14 +1,35 @@
 import os
+import csv
 import json
+import asyncio
 import random
+import itertools
+import tempfile
+from datetime import datetime, timedelta
 from typing import List, Dict, Any
 from aiogram import types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.dispatcher import FSMContext
+from aiogram.utils.exceptions import (
+    MessageNotModified, BadRequest, InvalidUserId, RetryAfter, NetworkError,
+)
 from aiogram.dispatcher.filters.state import State, StatesGroup
+from outbound import priority, CHANNEL, fanout, count_results
+from database import (
+    add_contest_participant,
+    add_contest_participants,
+    count_contest_participants,
+    get_contest_participants_page,
+    iter_contest_participants,
+    get_contest_seq_range,
+    get_contest_participants_by_seq,
+)
 
 # ==== ENV ====
 MAIN_CHANNELS = [c.strip() for c in (os.getenv("MAIN_CHANNELS") or "").split(",") if c.strip()]
+DRAW_CHECK_CONCURRENCY = int(os.getenv("DRAW_CHECK_CONCURRENCY", "10"))  # bir vaqtda tekshiriladigan nomzodlar
+PARTICIPANTS_PAGE_SIZE = int(os.getenv("PARTICIPANTS_PAGE_SIZE", "50"))
+MEMBER_CHECK_RETRIES = int(os.getenv("MEMBER_CHECK_RETRIES", "3"))
 
 # ==== FAYL YO'LLARI ====
 DATA_DIR = "participants"
@@ -18,28 +39,95 @@ CONTEST_FILE = os.path.join(DATA_DIR, "contest.json")
 # ==== FS ====
 def ensure_dirs():
     os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(PARTICIPANTS_FILE):
-        with open(PARTICIPANTS_FILE, "w", encoding="utf-8") as f:
-            json.dump({"participants": []}, f, indent=2, ensure_ascii=False)
-    if not os.path.exists(CONTEST_FILE):
-        with open(CONTEST_FILE, "w", encoding="utf-8") as f:
-            json.dump({"active": False, "post_ids": [], "winners": []}, f, indent=2, ensure_ascii=False)
+    contest.load()
 
-def load_participants():
-    with open(PARTICIPANTS_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+def _atomic_write(path: str, text: str):
+    # Avval vaqtinchalik faylga, so‘ng os.replace — yarim yozilgan fayl qolmaydi
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
 
-def save_participants(data):
-    with open(PARTICIPANTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+class ContestState:
+    """
+    Konkurs holati xotirada turadi, o‘qish diskka tegmaydi.
+    `save()` faqat yozishni rejalashtiradi: bir nechta chaqiruv bitta
+    yozuvga birlashadi, yozish esa executor da (event loop dan tashqarida) bo‘ladi.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = None
+        self._dirty = False
+        self._writer = None
+
+    def load(self):
+        if self.data is not None:
+            return
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        else:
+            self.data = {"id": 1, "active": False, "post_ids": [], "winners": []}
+            # Ishga tushishda, loop hali ishlamayotgan bo‘lishi mumkin
+            _atomic_write(self.path, json.dumps(self.data, indent=2, ensure_ascii=False))
+
+    def save(self):
+        self._dirty = True
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._write())
+
+    async def _write(self):
+        loop = asyncio.get_running_loop()
+        while self._dirty:
+            self._dirty = False
+            text = json.dumps(self.data, indent=2, ensure_ascii=False)
+            try:
+                await loop.run_in_executor(None, _atomic_write, self.path, text)
+            except OSError as e:
+                print(f"[konkurs] holatni yozishda xatolik: {e}")
+                return
+
+    async def flush(self):
+        if self._writer is not None:
+            await self._writer
+
+contest = ContestState(CONTEST_FILE)
 
 def load_contest():
-    with open(CONTEST_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    contest.load()
+    return contest.data
 
 def save_contest(data):
-    with open(CONTEST_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    contest.data = data
+    contest.save()
+
+def contest_id(st) -> int:
+    # Eski contest.json larda id yo‘q — ular 1-konkurs hisoblanadi
+    return st.get("id", 1)
+
+# ==== ISHTIROKCHILAR (BAZADA) ====
+_participants_migrated = False
+_migrate_lock = asyncio.Lock()
+
+async def migrate_participants_json():
+    """Eski participants.json bir marta joriy konkursga ko‘chiriladi va qayta nomlanadi."""
+    global _participants_migrated
+    if _participants_migrated:
+        return
+    async with _migrate_lock:
+        if _participants_migrated:
+            return
+        if os.path.exists(PARTICIPANTS_FILE):
+            with open(PARTICIPANTS_FILE, "r", encoding="utf-8") as f:
+                ids = json.load(f).get("participants", [])
+            if ids:
+                added = await add_contest_participants(contest_id(load_contest()), ids)
+                print(f"[konkurs] participants.json -> baza: {added} ta")
+            os.replace(PARTICIPANTS_FILE, PARTICIPANTS_FILE + ".migrated")
+        _participants_migrated = True
 
 # ==== HOLATLAR ====
 class KonkursStates(StatesGroup):
@@ -63,17 +151,91 @@ def participate_kb(bot_username: str):
     return kb
 
 # ==== SUBS TEKSHIRUV ====
-async def is_user_subscribed(bot, user_id: int) -> bool:
-    if not MAIN_CHANNELS:
-        return True
-    for ch in MAIN_CHANNELS:
+async def _is_member(bot, ch, user_id: int) -> bool:
+    """
+    Faqat aniq javobda False (a’zo emas / foydalanuvchi yo‘q).
+    Flood va tarmoq xatolarida kutib qayta tekshiradi, baribir
+    bo‘lmasa xatoni chiqaradi — nomzod noto‘g‘ri chetlatilmasin.
+    """
+    for attempt in range(MEMBER_CHECK_RETRIES + 1):
         try:
             member = await bot.get_chat_member(ch, user_id)
-            if getattr(member, "status", None) not in ("member", "administrator", "creator"):
-                return False
-        except:
+            return getattr(member, "status", None) in ("member", "administrator", "creator")
+        except InvalidUserId:
             return False
-    return True
+        except BadRequest as e:
+            if "user not found" in str(e).lower():
+                return False
+            raise
+        except RetryAfter as e:
+            if attempt == MEMBER_CHECK_RETRIES:
+                raise
+            await asyncio.sleep(e.timeout)
+        except (NetworkError, asyncio.TimeoutError):
+            if attempt == MEMBER_CHECK_RETRIES:
+                raise
+            await asyncio.sleep(0.5 * 2 ** attempt * random.uniform(0.5, 1.5))
+
+async def is_user_subscribed(bot, user_id: int) -> bool:
+    """Tekshirib bo‘lmasa xato chiqaradi (qarang: `_is_member`)."""
+    if not MAIN_CHANNELS:
+        return True
+    results = await asyncio.gather(*(_is_member(bot, ch, user_id) for ch in MAIN_CHANNELS))
+    return all(results)
+
+# ==== G'OLIBNI TANLASH ====
+def _lazy_sample(lo: int, hi: int):
+    """
+    [lo, hi] oraliqdagi sonlarni takrorlanmas tasodifiy tartibda beradi, butun
+    oraliqni aralashtirmasdan. Yarmidan ko‘pi ko‘rilgach qolgani aralashtiriladi.
+    """
+    n = hi - lo + 1
+    seen = set()
+    while len(seen) < n // 2:
+        i = random.randrange(lo, hi + 1)
+        if i in seen:
+            continue
+        seen.add(i)
+        yield i
+    rest = [i for i in range(lo, hi + 1) if i not in seen]
+    random.shuffle(rest)
+    yield from rest
+
+async def _sample_candidates(cid: int, exclude: set, size: int):
+    """
+    Tasodifiy nomzodlar partiyasi. Ro‘yxat bazadan to‘liq o‘qilmaydi: tasodifiy
+    `seq` raqamlari indeks bo‘yicha tekshiriladi, bo‘sh raqamlar tashlab ketiladi —
+    har bir ishtirokchi teng ehtimol bilan chiqadi.
+    """
+    bounds = await get_contest_seq_range(cid)
+    if bounds is None:
+        return
+    probes = _lazy_sample(*bounds)
+    while True:
+        seqs = list(itertools.islice(probes, size * 2))
+        if not seqs:
+            return
+        found = await get_contest_participants_by_seq(cid, seqs)
+        batch = [found[seq] for seq in seqs if seq in found and found[seq] not in exclude]
+        if batch:
+            yield batch
+
+async def draw_winner(bot, cid: int, winners: set):
+    """
+    Obunasi hali ham amal qiladigan tasodifiy ishtirokchini topadi.
+    Nomzodlar `DRAW_CHECK_CONCURRENCY` tadan parallel tekshiriladi; partiyada
+    tanlanish tartibidagi birinchi mos nomzod olinadi — natija ketma-ket
+    tekshirish bilan bir xil, adolatli. Hech kim mos kelmasa None.
+    Obunani tekshirib bo‘lmasa xato chiqadi — qur’a to‘xtaydi.
+    """
+    async for candidates in _sample_candidates(cid, winners, DRAW_CHECK_CONCURRENCY):
+        for i in range(0, len(candidates), DRAW_CHECK_CONCURRENCY):
+            batch = candidates[i:i + DRAW_CHECK_CONCURRENCY]
+            results = await asyncio.gather(*(is_user_subscribed(bot, uid) for uid in batch))
+            for uid, ok in zip(batch, results):
+                if ok:
+                    return uid
+    return None
 
 # ==== E'LON & DM ====
 async def announce_winners_to_channels(bot, winners: List[int]):
@@ -83,27 +245,92 @@ async def announce_winners_to_channels(bot, winners: List[int]):
     medals = ["🥇", "🥈", "🥉"]
     for i, uid in enumerate(winners[:3]):
         text += f"{medals[i]} <a href='tg://user?id={uid}'>{uid}</a>\n"
-    ok = fail = 0
-    for ch in MAIN_CHANNELS:
-        try:
-            await bot.send_message(ch, text, parse_mode="HTML", disable_web_page_preview=True)
-            ok += 1
-        except Exception as e:
-            print(f"[announce] {ch} -> {e}")
-            fail += 1
-    return ok, fail
+    with priority(CHANNEL):
+        results = await fanout(
+            MAIN_CHANNELS,
+            lambda ch: bot.send_message(ch, text, parse_mode="HTML", disable_web_page_preview=True),
+        )
+    for ch, result in results:
+        if isinstance(result, Exception):
+            print(f"[announce] {ch} -> {result}")
+    return count_results(results)
 
 async def dm_winners(bot, winners: List[int]):
     medals = ["🥇", "🥈", "🥉"]
-    for i, uid in enumerate(winners[:3]):
-        try:
-            await bot.send_message(
-                uid,
-                f"{medals[i]} Tabriklaymiz! Siz g‘olib bo‘ldingiz. 🎉\nAdmin tez orada bog‘lanadi.",
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            print(f"[dm_winner] {uid} -> {e}")
+    results = await fanout(
+        enumerate(winners[:3]),
+        lambda item: bot.send_message(
+            item[1],
+            f"{medals[item[0]]} Tabriklaymiz! Siz g‘olib bo‘ldingiz. 🎉\nAdmin tez orada bog‘lanadi.",
+            parse_mode="HTML"
+        ),
+    )
+    for (_, uid), result in results:
+        if isinstance(result, Exception):
+            print(f"[dm_winner] {uid} -> {result}")
+
+# ==== ISHTIROKCHILAR RO'YXATI ====
+_EPOCH = datetime(1970, 1, 1)
+
+def _encode_cursor(uid: int, joined_at) -> str:
+    # callback_data 64 bayt — vaqt mikrosekundlarda butun son
+    return f"{(joined_at - _EPOCH) // timedelta(microseconds=1)}:{uid}"
+
+def _decode_cursor(ts: str, uid: str):
+    return _EPOCH + timedelta(microseconds=int(ts)), int(uid)
+
+async def render_participants_page(cid: int, page: int = 0, cursor=None, backward: bool = False):
+    """
+    Sahifa (joined_at, user_id) keyset bo‘yicha o‘qiladi, kursor tugmada saqlanadi —
+    har bir bosish faqat bitta sahifani o‘qiydi.
+    """
+    total = await count_contest_participants(cid)
+    if not total:
+        return None
+    rows = await get_contest_participants_page(cid, PARTICIPANTS_PAGE_SIZE, cursor, backward)
+    if not rows:
+        if page == 0:
+            return None
+        return await render_participants_page(cid)
+    pages = (total + PARTICIPANTS_PAGE_SIZE - 1) // PARTICIPANTS_PAGE_SIZE
+    page = min(page, pages - 1)
+    text = f"👥 Ishtirokchilar: {total} ta\n\n"
+    for i, (uid, _) in enumerate(rows, page * PARTICIPANTS_PAGE_SIZE + 1):
+        text += f"{i}. <code>{uid}</code>\n"
+
+    kb = InlineKeyboardMarkup()
+    nav = []
+    if page > 0:
+        first = _encode_cursor(*rows[0])
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"kpart:{cid}:{page - 1}:p:{first}"))
+    nav.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="kpart:noop"))
+    if page + 1 < pages and len(rows) == PARTICIPANTS_PAGE_SIZE:
+        last = _encode_cursor(*rows[-1])
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"kpart:{cid}:{page + 1}:n:{last}"))
+    kb.row(*nav)
+    kb.add(InlineKeyboardButton("📥 CSV yuklab olish", callback_data=f"kpart:{cid}:csv"))
+    return text, kb
+
+async def export_participants_csv(bot, chat_id: int, cid: int):
+    """Ishtirokchilarni vaqtinchalik CSV faylga oqim bilan yozib, bitta hujjat qilib yuboradi."""
+    loop = asyncio.get_running_loop()
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    count = 0
+    try:
+        with open(fd, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["user_id", "joined_at"])
+            async for batch in iter_contest_participants(cid):
+                rows = [(uid, joined.isoformat() if joined else "") for uid, joined in batch]
+                await loop.run_in_executor(None, writer.writerows, rows)
+                count += len(rows)
+        await bot.send_document(
+            chat_id,
+            types.InputFile(path, filename=f"konkurs_{cid}_ishtirokchilar.csv"),
+            caption=f"👥 Ishtirokchilar: {count} ta",
+        )
+    finally:
+        os.remove(path)
 
 # ==== HANDLERLAR ====
 def register_konkurs_handlers(dp, bot, ADMINS: set):
@@ -114,16 +341,17 @@ def register_konkurs_handlers(dp, bot, ADMINS: set):
     async def cmd_start(message: types.Message):
         args = message.get_args().strip() if hasattr(message, "get_args") else ""
         if args == "konkurs":
-            subscribed = await is_user_subscribed(message.bot, message.from_user.id)
+            try:
+                subscribed = await is_user_subscribed(message.bot, message.from_user.id)
+            except Exception as e:
+                print(f"[konkurs] obuna tekshiruvi {message.from_user.id} -> {e}")
+                await message.answer("⚠️ Obunani tekshirib bo‘lmadi, birozdan so‘ng qayta urinib ko‘ring.")
+                return
             if not subscribed:
                 await message.answer("❗️ Avval kanallarga obuna bo‘ling, so‘ngra qayta urinib ko‘ring.")
                 return
-            pdata = load_participants()
-            arr = pdata.get("participants", [])
-            if message.from_user.id not in arr:
-                arr.append(message.from_user.id)
-                pdata["participants"] = arr
-                save_participants(pdata)
+            await migrate_participants_json()
+            await add_contest_participant(contest_id(load_contest()), message.from_user.id)
             await message.answer("✅ Ishtirok uchun rahmat! Siz ro‘yxatga qo‘shildingiz.")
             return
         await message.answer("Salom! Bu bot konkurslar o‘tkazadi.")
@@ -148,20 +376,13 @@ def register_konkurs_handlers(dp, bot, ADMINS: set):
             await KonkursStates.waiting_for_image.set()
             await callback.message.answer("🖼 Konkurs post uchun rasm yuboring.")
         elif action == "participants":
-            data = load_participants()
-            ids = data.get("participants", [])
-            if not ids:
+            await migrate_participants_json()
+            rendered = await render_participants_page(contest_id(load_contest()), 0)
+            if not rendered:
                 await callback.message.answer("ℹ️ Ishtirokchilar yo‘q.")
             else:
-                chunk = "👥 Ishtirokchilar:\n\n"
-                for i, uid in enumerate(ids, 1):
-                    line = f"{i}. <code>{uid}</code>\n"
-                    if len(chunk) + len(line) > 3800:
-                        await callback.message.answer(chunk, parse_mode="HTML")
-                        chunk = ""
-                    chunk += line
-                if chunk:
-                    await callback.message.answer(chunk, parse_mode="HTML")
+                text, kb = rendered
+                await callback.message.answer(text, parse_mode="HTML", reply_markup=kb)
         elif action == "finish":
             st = load_contest()
             st["active"] = False
@@ -178,17 +399,26 @@ def register_konkurs_handlers(dp, bot, ADMINS: set):
             if not st.get("active"):
                 await callback.message.answer("ℹ️ Konkurs faol emas.")
                 return
-            pdata = load_participants()
-            participants = pdata.get("participants", [])
+            await migrate_participants_json()
             winners = st.get("winners", [])
             if len(winners) >= 3:
                 await callback.message.answer("✅ 3 ta g‘olib tanlangan.")
                 return
-            candidates = [uid for uid in participants if uid not in winners]
-            if not candidates:
-                await callback.message.answer("❌ Nomzod qolmadi.")
+            await callback.answer("⏳ Nomzodlar tekshirilmoqda...")
+            try:
+                winner = await draw_winner(callback.message.bot, contest_id(st), set(winners))
+            except Exception as e:
+                print(f"[konkurs] qur’a to‘xtadi -> {e}")
+                await callback.message.answer(
+                    "⚠️ Nomzodlar obunasini tekshirib bo‘lmadi (Telegram cheklovi yoki tarmoq xatosi).\n"
+                    "G‘olib tanlanmadi — birozdan so‘ng qayta urinib ko‘ring."
+                )
+                return
+            if winner is None:
+                await callback.message.answer("❌ Obunasi saqlangan nomzod qolmadi.")
                 return
-            winner = random.choice(candidates)
+            if len(winners) >= 3 or winner in winners:
+                return  # tekshiruv paytida parallel bosish g‘olibni tanlab bo‘ldi
             winners.append(winner)
             st["winners"] = winners
             save_contest(st)
@@ -201,6 +431,33 @@ def register_konkurs_handlers(dp, bot, ADMINS: set):
                 await dm_winners(callback.message.bot, winners)
                 await callback.message.answer(f"🏁 Konkurs yakunlandi.\n📣 E’lon: {ok} ta, xato: {fail} ta.")
 
+    @dp.callback_query_handler(lambda c: c.data.startswith("kpart:"))
+    async def participants_page_cb(callback: CallbackQuery):
+        parts = callback.data.split(":")
+        if callback.from_user.id not in ADMINS or len(parts) not in (3, 6) or not parts[1].isdigit():
+            await callback.answer()
+            return
+        cid = int(parts[1])
+        if parts[2] == "csv":
+            await callback.answer("⏳ Fayl tayyorlanmoqda...")
+            await export_participants_csv(callback.message.bot, callback.message.chat.id, cid)
+            return
+        # kpart:<konkurs>:<sahifa>:<n|p>:<vaqt>:<user_id>
+        if len(parts) != 6 or not (parts[2].isdigit() and parts[4].isdigit() and parts[5].isdigit()):
+            await callback.answer()
+            return
+        cursor = _decode_cursor(parts[4], parts[5])
+        rendered = await render_participants_page(cid, int(parts[2]), cursor, backward=parts[3] == "p")
+        if not rendered:
+            await callback.answer("ℹ️ Ishtirokchilar yo‘q.")
+            return
+        text, kb = rendered
+        try:
+            await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
+        except MessageNotModified:
+            pass
+        await callback.answer()
+
     @dp.message_handler(content_types=types.ContentType.PHOTO, state=KonkursStates.waiting_for_image)
     async def konkurs_get_image(message: types.Message, state: FSMContext):
         if message.from_user.id not in ADMINS:
@@ -220,25 +477,26 @@ def register_konkurs_handlers(dp, bot, ADMINS: set):
             await message.answer("❌ MAIN_CHANNELS topilmadi.")
             await state.finish()
             return
+        await migrate_participants_json()  # eski ishtirokchilar eski konkursga yozilsin
         st = load_contest()
+        st["id"] = contest_id(st) + 1  # yangi konkurs — ishtirokchilar noldan
         st["active"] = True
         st["post_ids"] = []
         st["winners"] = []
         save_contest(st)
         me = await message.bot.get_me()
         kb = participate_kb(me.username)
-        ok = fail = 0
-        for ch in MAIN_CHANNELS:
-            try:
-                sent = await message.bot.send_photo(ch, photo=photo_id, caption=caption, reply_markup=kb)
-                st = load_contest()
-                post_ids = st.get("post_ids", [])
-                post_ids.append({"chat": ch, "message_id": sent.message_id})
-                st["post_ids"] = post_ids
-                save_contest(st)
-                ok += 1
-            except Exception as e:
-                print(f"[POST] {ch} -> {e}")
-                fail += 1
+        with priority(CHANNEL):
+            results = await fanout(
+                MAIN_CHANNELS,
+                lambda ch: message.bot.send_photo(ch, photo=photo_id, caption=caption, reply_markup=kb),
+            )
+        for ch, result in results:
+            if isinstance(result, Exception):
+                print(f"[POST] {ch} -> {result}")
+            else:
+                st["post_ids"].append({"chat": ch, "message_id": result.message_id})
+        ok, fail = count_results(results)
+        save_contest(st)
         await message.answer(f"✅ Yuborildi: {ok} ta\n❌ Xato: {fail} ta\n🟢 Konkurs FAOL")
         await state.finish()
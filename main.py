@@ -3,10 +3,10 @@
 import io
 import os
 import asyncio
-import time
+from itertools import groupby
 from datetime import datetime, date
 from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher, types
+from aiogram import Dispatcher, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
@@ -15,22 +15,39 @@ from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 )
 from aiogram.utils import executor
+from aiogram.utils.exceptions import MessageNotModified, BadRequest
 from keep_alive import keep_alive
+from filters import IsAdmin
+from middlewares import ActivityMiddleware
+from broadcast import start_broadcast, resume_broadcasts
+from delivery import DeliveryScheduler
+from outbound import OutboundBot, priority, CHANNEL, fanout, count_results
+from cache import TTLCache
+from konkurs import contest
 from database import (
     init_db,
+    close_db,
+    pool_supervisor,
+    buffer_flusher,
     add_user,
-    get_user_count,
+    load_known_users,
+    get_known_users_stats,
     get_kino_by_code,
-    get_all_codes,
+    get_catalog_page,
+    get_catalog_version,
     delete_kino_code,
     get_code_stat,
     increment_stat,
-    get_all_user_ids,
     update_anime_code,
-    get_today_users,
+    get_dashboard,
+    get_anime_cache_stats,
+    get_pool_stats,
     add_anime,
     add_part_to_anime,
-    delete_part_from_anime, get_all_admins, add_admin, remove_admin
+    delete_part_from_anime, add_admin, remove_admin,
+    admin_ids,
+    load_admins,
+    admins_listener,
 )
 
 # === YUKLAMALAR ===
@@ -44,12 +61,14 @@ MAIN_CHANNELS = []
 MAIN_LINKS = []
 BOT_USERNAME = os.getenv("BOT_USERNAME")
 
-bot = Bot(token=API_TOKEN)
+bot = OutboundBot(token=API_TOKEN)
 storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
+dp.filters_factory.bind(IsAdmin)
+dp.middleware.setup(ActivityMiddleware())
 
 START_ADMINS = [6486825926, 7346481297]  # dastlabki adminlar
-ADMINS = set(START_ADMINS)
+ADMINS = admin_ids  # bazadagi `admins` jadvali bilan sinxron
 
 # === KEYBOARDS ===
 def edit_menu_keyboard():
@@ -124,32 +143,79 @@ class AddAnimeStates(StatesGroup):
     waiting_for_parts = State()
 
 # === OBUNA TEKSHIRISH ===
+# Faqat obuna bo‘lganlar keshlanadi: obuna bo‘lmagan foydalanuvchi
+# obuna bo‘lgach keyingi "✅ Tekshirish"da darhol o‘tadi.
+subscription_cache = TTLCache(
+    maxsize=int(os.getenv("SUB_CACHE_SIZE", "50000")),
+    ttl=float(os.getenv("SUB_CACHE_TTL", "120")),
+)
+
+
+async def is_channel_member(channel_id, user_id) -> bool:
+    key = (user_id, channel_id)
+    if subscription_cache.get(key, False):
+        return True
+    try:
+        member = await bot.get_chat_member(channel_id, user_id)
+    except Exception as e:
+        print(f"❗ Obuna tekshirishda xatolik: {channel_id} -> {e}")
+        return False
+    if member.status in ["member", "administrator", "creator"]:
+        subscription_cache.set(key, True)
+        return True
+    return False
+
+
 async def get_unsubscribed_channels(user_id):
-    unsubscribed = []
-    for idx, channel_id in enumerate(CHANNELS):
-        try:
-            member = await bot.get_chat_member(channel_id, user_id)
-            if member.status not in ["member", "administrator", "creator"]:
-                unsubscribed.append((channel_id, LINKS[idx]))
-        except Exception as e:
-            print(f"❗ Obuna tekshirishda xatolik: {channel_id} -> {e}")
-            unsubscribed.append((channel_id, LINKS[idx]))
-    return unsubscribed
+    channels = list(zip(CHANNELS, LINKS))
+    results = await asyncio.gather(
+        *(is_channel_member(channel_id, user_id) for channel_id, _ in channels)
+    )
+    return [ch for ch, ok in zip(channels, results) if not ok]
 
 
-# === OBUNA BO‘LMAGANLAR MARKUP ===
-async def make_unsubscribed_markup(user_id, code):
-    unsubscribed = await get_unsubscribed_channels(user_id)
-    markup = InlineKeyboardMarkup(row_width=1)
+# === KANAL MA'LUMOTLARI KESHI ===
+# channel_id -> {"title", "link", "type"}; tugmalar shu yerdan quriladi
+CHANNEL_INFO = {}
+CHANNEL_INFO_REFRESH = int(os.getenv("CHANNEL_INFO_REFRESH", "3600"))
+
 
+async def load_channel_info(channel_id, link, ctype):
+    try:
+        chat = await bot.get_chat(channel_id)
+        title = chat.title
+    except Exception as e:
+        print(f"❗ Kanal ma'lumotini olishda xatolik: {channel_id} -> {e}")
+        old = CHANNEL_INFO.get(channel_id)
+        title = old["title"] if old else str(channel_id)
+    CHANNEL_INFO[channel_id] = {"title": title, "link": link, "type": ctype}
+    return CHANNEL_INFO[channel_id]
+
+
+async def channel_info_refresher():
+    """Kanal nomlarini fon rejimida vaqti-vaqti bilan yangilaydi."""
+    while True:
+        await asyncio.sleep(CHANNEL_INFO_REFRESH)
+        channels = [(cid, link, "sub") for cid, link in zip(CHANNELS, LINKS)]
+        channels += [(cid, link, "main") for cid, link in zip(MAIN_CHANNELS, MAIN_LINKS)]
+        for channel_id, link, ctype in channels:
+            await load_channel_info(channel_id, link, ctype)
+
+
+async def add_channel_buttons(markup, unsubscribed):
     for channel_id, channel_link in unsubscribed:
-        try:
-            chat = await bot.get_chat(channel_id)
-            markup.add(
-                InlineKeyboardButton(f"➕ {chat.title}", url=channel_link)
-            )
-        except Exception as e:
-            print(f"❗ Kanal tugmasini yaratishda xatolik: {channel_id} -> {e}")
+        info = CHANNEL_INFO.get(channel_id)
+        if info is None:
+            info = await load_channel_info(channel_id, channel_link, "sub")
+        markup.add(InlineKeyboardButton(f"➕ {info['title']}", url=channel_link))
+
+
+# === OBUNA BO‘LMAGANLAR MARKUP ===
+async def make_unsubscribed_markup(user_id, code, unsubscribed=None):
+    if unsubscribed is None:
+        unsubscribed = await get_unsubscribed_channels(user_id)
+    markup = InlineKeyboardMarkup(row_width=1)
+    await add_channel_buttons(markup, unsubscribed)
 
     # Tekshirish tugmasi
     markup.add(InlineKeyboardButton("✅ Tekshirish", callback_data=f"checksub:{code}"))
@@ -159,7 +225,7 @@ async def make_unsubscribed_markup(user_id, code):
 # === /start HANDLER ===
 @dp.message_handler(commands=['start'])
 async def start_handler(message: types.Message):
-    await add_user(message.from_user.id)
+    add_user(message.from_user.id)  # ma’lum foydalanuvchi uchun bazaga murojaat yo‘q
     args = message.get_args()
 
     if args and args.isdigit():
@@ -169,7 +235,7 @@ async def start_handler(message: types.Message):
 
         unsubscribed = await get_unsubscribed_channels(message.from_user.id)
         if unsubscribed:
-            markup = await make_unsubscribed_markup(message.from_user.id, code)
+            markup = await make_unsubscribed_markup(message.from_user.id, code, unsubscribed)
             await message.answer(
                 "❗ Animeni olishdan oldin quyidagi kanal(lar)ga obuna bo‘ling:",
                 reply_markup=markup
@@ -195,14 +261,7 @@ async def check_subscription_callback(call: CallbackQuery):
 
     if unsubscribed:
         markup = InlineKeyboardMarkup(row_width=1)
-        for channel_id, channel_link in unsubscribed:
-            try:
-                chat = await bot.get_chat(channel_id)
-                markup.add(
-                    InlineKeyboardButton(f"➕ {chat.title}", url=channel_link)
-                )
-            except Exception as e:
-                print(f"❗ Kanal tugmasini qayta yaratishda xatolik: {channel_id} -> {e}")
+        await add_channel_buttons(markup, unsubscribed)
 
         markup.add(InlineKeyboardButton("✅ Yana tekshirish", callback_data=f"checksub:{code}"))
         await call.message.edit_text("❗ Hali ham obuna bo‘lmagan kanal(lar):", reply_markup=markup)
@@ -212,26 +271,68 @@ async def check_subscription_callback(call: CallbackQuery):
         await increment_stat(code, "searched")
 
 
-# === Barcha animelar ===
-@dp.message_handler(lambda m: m.text == "🎞 Barcha animelar")
+# === Barcha animelar (sahifalab) ===
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "50"))
+# (katalog versiyasi, sahifa) -> (matn, klaviatura, jami sahifalar)
+catalog_pages = TTLCache(maxsize=256, ttl=3600)
+
+
+async def render_catalog_page(page: int):
+    key = (get_catalog_version(), page)
+    cached = catalog_pages.get(key, None)
+    if cached is not None:
+        return cached
+
+    rows, total = await get_catalog_page(page * CATALOG_PAGE_SIZE, CATALOG_PAGE_SIZE)
+    if not total:
+        return None
+    pages = (total + CATALOG_PAGE_SIZE - 1) // CATALOG_PAGE_SIZE
+    if not rows:
+        # Katalog qisqargan bo‘lsa oxirgi sahifani ko‘rsatamiz
+        return await render_catalog_page(pages - 1)
+    text = "📄 *Barcha animelar:*\n\n"
+    for code, title in rows:
+        text += f"`{code}` – *{title}*\n"
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"catalog:{page - 1}"))
+    nav.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="catalog:noop"))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"catalog:{page + 1}"))
+    markup = InlineKeyboardMarkup().row(*nav)
+
+    result = (text, markup, pages)
+    catalog_pages.set(key, result)
+    return result
+
+
+@dp.message_handler(lambda m: m.text in ("🎞 Barcha animelar", "📄 Kodlar ro‘yxati"))
 async def show_all_animes(message: types.Message):
-    kodlar = await get_all_codes()
-    if not kodlar:
+    rendered = await render_catalog_page(0)
+    if not rendered:
         await message.answer("⛔️ Hozircha animelar yoʻq.")
         return
+    text, markup, _ = rendered
+    await message.answer(text, parse_mode="Markdown", reply_markup=markup)
 
-    kodlar = sorted(kodlar, key=lambda x: int(x["code"]))
-
-    # 100 tadan bo‘lib yuborish
-    chunk_size = 100
-    for i in range(0, len(kodlar), chunk_size):
-        chunk = kodlar[i:i + chunk_size]
 
-        text = "📄 *Barcha animelar:*\n\n"
-        for row in chunk:
-            text += f"`{row['code']}` – *{row['title']}*\n"
-
-        await message.answer(text, parse_mode="Markdown")
+@dp.callback_query_handler(lambda c: c.data.startswith("catalog:"))
+async def catalog_page_callback(call: CallbackQuery):
+    arg = call.data.split(":")[1]
+    if not arg.isdigit():
+        await call.answer()
+        return
+    rendered = await render_catalog_page(int(arg))
+    if not rendered:
+        await call.answer("⛔️ Hozircha animelar yoʻq.")
+        return
+    text, markup, _ = rendered
+    try:
+        await call.message.edit_text(text, parse_mode="Markdown", reply_markup=markup)
+    except MessageNotModified:
+        pass
+    await call.answer()
 
 
 # === Admin bilan bog‘lanish (foydalanuvchi qismi) ===
@@ -264,22 +365,21 @@ async def forward_to_admins(message: types.Message, state: FSMContext):
     await state.finish()
     user = message.from_user
 
-    for admin_id in ADMINS:
-        try:
-            keyboard = InlineKeyboardMarkup().add(
-                InlineKeyboardButton("✉️ Javob yozish", callback_data=f"reply_user:{user.id}")
-            )
-
-            await bot.send_message(
-                admin_id,
-                f"📩 <b>Yangi xabar:</b>\n\n"
-                f"<b>👤 Foydalanuvchi:</b> {user.full_name} | <code>{user.id}</code>\n"
-                f"<b>💬 Xabar:</b> {message.text}",
-                parse_mode="HTML",
-                reply_markup=keyboard
-            )
-        except Exception as e:
-            print(f"Adminga yuborishda xatolik: {e}")
+    keyboard = InlineKeyboardMarkup().add(
+        InlineKeyboardButton("✉️ Javob yozish", callback_data=f"reply_user:{user.id}")
+    )
+    text = (
+        f"📩 <b>Yangi xabar:</b>\n\n"
+        f"<b>👤 Foydalanuvchi:</b> {user.full_name} | <code>{user.id}</code>\n"
+        f"<b>💬 Xabar:</b> {message.text}"
+    )
+    results = await fanout(
+        ADMINS,
+        lambda admin_id: bot.send_message(admin_id, text, parse_mode="HTML", reply_markup=keyboard),
+    )
+    for admin_id, result in results:
+        if isinstance(result, Exception):
+            print(f"Adminga yuborishda xatolik: {admin_id} -> {result}")
 
     await message.answer(
         "✅ Xabaringiz yuborildi. Tez orada admin siz bilan bog‘lanadi.",
@@ -288,7 +388,7 @@ async def forward_to_admins(message: types.Message, state: FSMContext):
         )
     )
 
-@dp.callback_query_handler(lambda c: c.data.startswith("reply_user:"), user_id=ADMINS)
+@dp.callback_query_handler(lambda c: c.data.startswith("reply_user:"), is_admin=True)
 async def start_admin_reply(callback: CallbackQuery, state: FSMContext):
     user_id = int(callback.data.split(":")[1])
     await state.update_data(reply_user_id=user_id)
@@ -296,7 +396,7 @@ async def start_admin_reply(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer("✍️ Endi foydalanuvchiga yubormoqchi bo‘lgan xabaringizni yozing.")
     await callback.answer()
 
-@dp.message_handler(state=AdminReplyStates.waiting_for_reply_message, user_id=ADMINS)
+@dp.message_handler(state=AdminReplyStates.waiting_for_reply_message, is_admin=True)
 async def send_admin_reply(message: types.Message, state: FSMContext):
     data = await state.get_data()
     user_id = data.get("reply_user_id")
@@ -310,7 +410,7 @@ async def send_admin_reply(message: types.Message, state: FSMContext):
         await state.finish()
     
 # === Kanal boshqaruvi menyusi ===
-@dp.message_handler(lambda m: m.text == "📡 Kanal boshqaruvi", user_id=ADMINS)
+@dp.message_handler(lambda m: m.text == "📡 Kanal boshqaruvi", is_admin=True)
 async def kanal_boshqaruvi(message: types.Message):
     kb = InlineKeyboardMarkup()
     kb.add(
@@ -321,7 +421,7 @@ async def kanal_boshqaruvi(message: types.Message):
 
 
 # === Kanal turi tanlanadi ===
-@dp.callback_query_handler(lambda c: c.data.startswith("channel_type:"), user_id=ADMINS)
+@dp.callback_query_handler(lambda c: c.data.startswith("channel_type:"), is_admin=True)
 async def select_channel_type(callback: types.CallbackQuery, state: FSMContext):
     ctype = callback.data.split(":")[1]
     await state.update_data(channel_type=ctype)
@@ -342,7 +442,7 @@ async def select_channel_type(callback: types.CallbackQuery, state: FSMContext):
 
 
 # === Actionlarni boshqarish ===
-@dp.callback_query_handler(lambda c: c.data.startswith("action:"), user_id=ADMINS)
+@dp.callback_query_handler(lambda c: c.data.startswith("action:"), is_admin=True)
 async def channel_actions(callback: types.CallbackQuery, state: FSMContext):
     action = callback.data.split(":")[1]
     data = await state.get_data()
@@ -400,7 +500,7 @@ async def channel_actions(callback: types.CallbackQuery, state: FSMContext):
 
 
 # === 1. Kanal ID qabul qilish ===
-@dp.message_handler(state=KanalStates.waiting_for_channel_id, user_id=ADMINS)
+@dp.message_handler(state=KanalStates.waiting_for_channel_id, is_admin=True)
 async def add_channel_id(message: types.Message, state: FSMContext):
     try:
         channel_id = int(message.text.strip())
@@ -412,7 +512,7 @@ async def add_channel_id(message: types.Message, state: FSMContext):
 
 
 # === 2. Kanal linkini qabul qilish va saqlash ===
-@dp.message_handler(state=KanalStates.waiting_for_channel_link, user_id=ADMINS)
+@dp.message_handler(state=KanalStates.waiting_for_channel_link, is_admin=True)
 async def add_channel_finish(message: types.Message, state: FSMContext):
     data = await state.get_data()
     ctype = data.get("channel_type")
@@ -437,6 +537,8 @@ async def add_channel_finish(message: types.Message, state: FSMContext):
         await message.answer(f"⚠️ Kanal tekshirib bo‘lmadi: {e}")
         await state.finish()
         return
+    # Bot kanalga qaytarilgan — eski BotKicked/ChatNotFound bloki endi kerak emas
+    bot.breaker.reset(channel_id)
     # 🔐 Agar admin bo‘lsa – keyin ro‘yxatga qo‘shamiz
     if ctype == "sub":
         if channel_id in CHANNELS:
@@ -444,6 +546,7 @@ async def add_channel_finish(message: types.Message, state: FSMContext):
         else:
             CHANNELS.append(channel_id)
             LINKS.append(channel_link)
+            await load_channel_info(channel_id, channel_link, "sub")
             await message.answer(f"✅ Kanal qo‘shildi!\n🆔 {channel_id}\n🔗 {channel_link}")
     else:
         if channel_id in MAIN_CHANNELS:
@@ -451,6 +554,7 @@ async def add_channel_finish(message: types.Message, state: FSMContext):
         else:
             MAIN_CHANNELS.append(channel_id)
             MAIN_LINKS.append(channel_link)
+            await load_channel_info(channel_id, channel_link, "main")
             await message.answer(f"✅ Asosiy kanal qo‘shildi!\n🆔 {channel_id}\n🔗 {channel_link}")
 
     await state.finish()
@@ -458,7 +562,7 @@ async def add_channel_finish(message: types.Message, state: FSMContext):
 
 
 # === Kanalni o‘chirish ===
-@dp.callback_query_handler(lambda c: c.data.startswith("del_"), user_id=ADMINS)
+@dp.callback_query_handler(lambda c: c.data.startswith("del_"), is_admin=True)
 async def delete_channel(callback: types.CallbackQuery):
     action, cid = callback.data.split(":")
     cid = int(cid)
@@ -468,12 +572,16 @@ async def delete_channel(callback: types.CallbackQuery):
             idx = CHANNELS.index(cid)
             CHANNELS.pop(idx)
             LINKS.pop(idx)
+            if cid not in MAIN_CHANNELS:
+                CHANNEL_INFO.pop(cid, None)
             await callback.message.answer(f"❌ Kanal o‘chirildi!\n🆔 {cid}")
     elif action == "del_main":
         if cid in MAIN_CHANNELS:
             idx = MAIN_CHANNELS.index(cid)
             MAIN_CHANNELS.pop(idx)
             MAIN_LINKS.pop(idx)
+            if cid not in CHANNELS:
+                CHANNEL_INFO.pop(cid, None)
             await callback.message.answer(f"❌ Asosiy kanal o‘chirildi!\n🆔 {cid}")
 
     await callback.answer("O‘chirildi ✅")
@@ -516,7 +624,7 @@ async def add_admin_process(message: types.Message, state: FSMContext):
         await state.finish()
         return
 
-    ADMINS.add(new_admin_id)
+    await add_admin(new_admin_id)
     await message.answer(f"✅ <code>{new_admin_id}</code> admin sifatida qo‘shildi.", parse_mode="HTML", reply_markup=control_keyboard())
     try:
         await bot.send_message(new_admin_id, "✅ Siz botga admin sifatida qo‘shildingiz.")
@@ -571,7 +679,7 @@ async def remove_admin_process(message: types.Message, state: FSMContext):
     if remove_id not in ADMINS:
         await message.answer("ℹ️ Bu ID ro‘yxatda yo‘q.", reply_markup=control_keyboard())
     else:
-        ADMINS.remove(remove_id)
+        await remove_admin(remove_id)
         await message.answer(
             f"✅ <code>{remove_id}</code> admin ro‘yxatidan o‘chirildi.",
             parse_mode="HTML",
@@ -630,7 +738,7 @@ async def show_code_stat(message: types.Message, state: FSMContext):
 
 
 # === Kodni tahrirlash (ANIME) ===
-@dp.message_handler(lambda m: m.text == "✏️ Kodni tahrirlash", user_id=ADMINS)
+@dp.message_handler(lambda m: m.text == "✏️ Kodni tahrirlash", is_admin=True)
 async def edit_anime_start(message: types.Message):
     await EditAnimeStates.waiting_for_code.set()
     await message.answer(
@@ -638,7 +746,7 @@ async def edit_anime_start(message: types.Message):
         reply_markup=control_keyboard()   # 🔹 Boshqarish tugmasi chiqadi
     )
 
-@dp.message_handler(state=EditAnimeStates.waiting_for_code, user_id=ADMINS)
+@dp.message_handler(state=EditAnimeStates.waiting_for_code, is_admin=True)
 async def edit_anime_code(message: types.Message, state: FSMContext):
     # 🔹 Agar admin "📡 Boshqarish" tugmasini bossa
     if message.text == "📡 Boshqarish":
@@ -685,7 +793,8 @@ async def add_part_start(message: types.Message, state: FSMContext):
 async def add_part_finish(message: types.Message, state: FSMContext):
     data = await state.get_data()
     file_id = message.video.file_id if message.video else message.document.file_id
-    await add_part_to_anime(data["code"], file_id)  # <== bu funksiyani database.py da yozish kerak
+    kind = "video" if message.video else "document"
+    await add_part_to_anime(data["code"], file_id, kind)  # <== bu funksiyani database.py da yozish kerak
     await message.answer("✅ Qism qo‘shildi.", reply_markup=admin_keyboard())
     await state.finish()
 
@@ -710,7 +819,7 @@ async def go_back(message: types.Message, state: FSMContext):
     await send_admin_panel(message)
 
 # === Kodni o'chirish ===
-@dp.message_handler(lambda m: m.text == "❌ Kodni o‘chirish", user_id=ADMINS)
+@dp.message_handler(lambda m: m.text == "❌ Kodni o‘chirish", is_admin=True)
 async def ask_delete_code(message: types.Message):
     await AdminStates.waiting_for_delete_code.set()
     await message.answer("🗑 Qaysi kodni o‘chirmoqchisiz? Kodni yuboring.", reply_markup=control_keyboard())
@@ -766,7 +875,7 @@ async def anime_poster_handler(message: types.Message, state: FSMContext):
         file_id = message.document.file_id
 
     caption = message.caption if message.caption else ""
-    await state.update_data(poster_file_id=file_id, caption=caption, parts_file_ids=[])
+    await state.update_data(poster_file_id=file_id, caption=caption, parts_file_ids=[], parts_kinds=[])
 
     await message.answer("📥 Endi qismlarni yuboring (video/file). Oxirida /done yuboring.")
     await AddAnimeStates.waiting_for_parts.set()
@@ -776,11 +885,13 @@ async def anime_poster_handler(message: types.Message, state: FSMContext):
 async def anime_parts_handler(message: types.Message, state: FSMContext):
     data = await state.get_data()
     parts = data.get("parts_file_ids", [])
+    kinds = data.get("parts_kinds", [])
 
     file_id = message.video.file_id if message.video else message.document.file_id
     parts.append(file_id)
+    kinds.append("video" if message.video else "document")
 
-    await state.update_data(parts_file_ids=parts)
+    await state.update_data(parts_file_ids=parts, parts_kinds=kinds)
     await message.answer(f"✅ Qism qo‘shildi. Hozircha {len(parts)} ta qism saqlandi.")
 
 @dp.message_handler(lambda m: m.text.lower() == "/done", state=AddAnimeStates.waiting_for_parts)
@@ -792,7 +903,7 @@ async def anime_done_handler(message: types.Message, state: FSMContext):
     caption = data["caption"]
     parts_file_ids = data["parts_file_ids"]
 
-    await add_anime(code, title, poster_file_id, parts_file_ids, caption)
+    await add_anime(code, title, poster_file_id, parts_file_ids, caption, data.get("parts_kinds"))
 
     await message.answer(
         f"✅ Anime saqlandi!\n\n"
@@ -841,23 +952,23 @@ async def send_post_by_code(message: types.Message, state: FSMContext):
         )
     )
 
-    successful, failed = 0, 0
-    for ch in MAIN_CHANNELS:
-        try:
-            # Poster faylini yuborish
-            if kino['poster_file_id']:
-                if kino.get('caption'):
-                    await bot.send_photo(ch, kino['poster_file_id'], caption=kino['caption'], reply_markup=download_btn)
-                else:
-                    await bot.send_photo(ch, kino['poster_file_id'], reply_markup=download_btn)
-            # Agar poster video yoki document bo‘lsa
-            elif kino['poster_file_id']:
-                await bot.send_document(ch, kino['poster_file_id'], caption=kino.get('caption', ''), reply_markup=download_btn)
-
-            successful += 1
-        except Exception as e:
-            print(f"Xato: {e}")
-            failed += 1
+    async def post(ch):
+        # Poster faylini yuborish
+        if kino['poster_file_id']:
+            if kino.get('caption'):
+                await bot.send_photo(ch, kino['poster_file_id'], caption=kino['caption'], reply_markup=download_btn)
+            else:
+                await bot.send_photo(ch, kino['poster_file_id'], reply_markup=download_btn)
+        # Agar poster video yoki document bo‘lsa
+        elif kino['poster_file_id']:
+            await bot.send_document(ch, kino['poster_file_id'], caption=kino.get('caption', ''), reply_markup=download_btn)
+
+    with priority(CHANNEL):  # foydalanuvchi javoblaridan keyin navbatga turadi
+        results = await fanout(MAIN_CHANNELS, post)
+    for ch, result in results:
+        if isinstance(result, Exception):
+            print(f"Xato: {ch} -> {result}")
+    successful, failed = count_results(results)
 
     await message.answer(
         f"✅ Post yuborildi.\n\n✅ Muvaffaqiyatli: {successful}\n❌ Xatolik: {failed}",
@@ -865,54 +976,44 @@ async def send_post_by_code(message: types.Message, state: FSMContext):
     )
     await state.finish()
 
-# === Kodlar ro'yxati ===
-@dp.message_handler(lambda m: m.text == "📄 Kodlar ro‘yxati")
-async def show_all_animes(message: types.Message):
-    kodlar = await get_all_codes()
-    if not kodlar:
-        await message.answer("Ba'zada hech qanday kodlar yo'q!")
-        return
-    kodlar = sorted(kodlar, key=lambda x: int(x["code"]))
-    chunk_size = 100
-    for i in range(0, len(kodlar), chunk_size):
-        chunk = kodlar[i:i + chunk_size]
-        text = "📄 *Barcha animelar:*\n\n"
-        for row in chunk:
-            text += f"`{row['code']}` – *{row['title']}*\n"
-        await message.answer(text, parse_mode="Markdown")
-
-
 # === Statistika ===
-@dp.message_handler(lambda m: m.text == "📊 Statistika")
+@dp.message_handler(lambda m: m.text == "📊 Statistika", is_admin=True)
 async def stats(message: types.Message):
-    from database import db_pool
-    async with db_pool.acquire() as conn:
-        start = time.perf_counter()
-        await conn.fetch("SELECT 1;")
-        ping = (time.perf_counter() - start) * 1000
-    kodlar = await get_all_codes()
-    foydalanuvchilar = await get_user_count()
-    today_users = await get_today_users()
+    data = await get_dashboard()
+    cache = get_anime_cache_stats()
+    known = get_known_users_stats()
+    pool = get_pool_stats()
+    queue = delivery.stats()
+    errors = bot.stats()["errors"]
     text = (
-        f"💡 O'rtacha yuklanish: {ping:.2f} ms\n\n"
-        f"👥 Foydalanuvchilar: {foydalanuvchilar} ta\n\n"
-        f"📂 Barcha yuklangan animelar: {len(kodlar)} ta\n\n"
-        f"📅 Bugun qo'shilgan foydalanuvchilar: {today_users} ta"
+        f"💡 O'rtacha yuklanish: {data['ping_ms']:.2f} ms\n\n"
+        f"👥 Foydalanuvchilar: {data['users']} ta\n\n"
+        f"📂 Barcha yuklangan animelar: {data['codes']} ta\n\n"
+        f"📅 Bugun qo'shilgan foydalanuvchilar: {data['today_users']} ta\n"
+        f"🗓 Oxirgi 7 kun: {data['week_users']} ta | 30 kun: {data['month_users']} ta\n"
+        f"📈 Kunlar bo‘yicha (7 kun): {' · '.join(map(str, data['last_7_days']))}\n\n"
+        f"🧠 Kesh: {cache['hits']} topildi / {cache['misses']} topilmadi\n"
+        f"🗂 Xotiradagi foydalanuvchilar: {known['size']} ta ({known['bytes'] / 1048576:.1f} MB)\n"
+        f"🔌 Baza: {'⚠️ uzilgan' if pool['degraded'] else '✅ ulangan'} | "
+        f"qayta ulanishlar: {pool['reconnects']} | uzilishda: {pool['degraded_seconds']:.0f} s\n"
+        f"📦 Yuborish navbati: {queue['users']} foydalanuvchi, {queue['units']} albom"
+        + ("\n⚠️ Telegram xatolari: " + ", ".join(f"{k}: {v}" for k, v in errors.items()) if errors else "")
     )
     await message.answer(text, reply_markup=admin_keyboard())
 
 
 # === Orqaga tugmasi ===
-@dp.message_handler(lambda m: m.text == "⬅️ Orqaga", user_id=ADMINS)
+@dp.message_handler(lambda m: m.text == "⬅️ Orqaga", is_admin=True)
 async def back_to_admin_menu(message: types.Message):
     await send_admin_panel(message)
 
 # === Habar yuborish ===
-@dp.message_handler(lambda m: m.text == "📢 Habar yuborish", user_id=ADMINS)
+@dp.message_handler(lambda m: m.text == "📢 Habar yuborish", is_admin=True)
 async def ask_broadcast_info(message: types.Message):
     await AdminStates.waiting_for_broadcast_data.set()
     await message.answer(
-        "📨 Habar yuborish uchun format:\n`@kanal xabar_id`",
+        "📨 Habar yuborish uchun format:\n`@kanal xabar_id`\n\n"
+        "Faqat oxirgi N kunda faol bo‘lganlarga: `@kanal xabar_id N`",
         parse_mode="Markdown",
         reply_markup=control_keyboard()
     )
@@ -926,37 +1027,28 @@ async def send_forward_only(message: types.Message, state: FSMContext):
         return
 
     parts = message.text.strip().split()
-    if len(parts) != 2:
-        await message.answer("❗ Format noto‘g‘ri. Masalan: `@kanalim 123`", reply_markup=control_keyboard())
+    if len(parts) not in (2, 3):
+        await message.answer("❗ Format noto‘g‘ri. Masalan: `@kanalim 123` yoki `@kanalim 123 7`", reply_markup=control_keyboard())
         return
 
-    channel_username, msg_id = parts
+    channel_username, msg_id = parts[:2]
     if not msg_id.isdigit():
         await message.answer("❗ Xabar ID raqam bo‘lishi kerak.", reply_markup=control_keyboard())
         return
+    active_days = None
+    if len(parts) == 3:
+        if not parts[2].isdigit() or int(parts[2]) == 0:
+            await message.answer("❗ Kunlar soni musbat raqam bo‘lishi kerak.", reply_markup=control_keyboard())
+            return
+        active_days = int(parts[2])
 
     msg_id = int(msg_id)
-    users = await get_all_user_ids()
-    success = 0
-    fail = 0
-
-    for index, user_id in enumerate(users, start=1):
-        try:
-            await bot.forward_message(user_id, channel_username, msg_id)
-            success += 1
-        except Exception as e:
-            print(f"Xatolik {user_id} uchun: {e}")
-            fail += 1
-
-        # Har 20 ta yuborilganda 1 sekund kutish
-        if index % 20 == 0:
-            await asyncio.sleep(1.5)
-
-    # Shu yerda state tugatiladi
     await state.finish()
 
+    # Yuborish fon rejimida ketadi, jarayon haqida alohida xabar yangilanib turadi
+    await start_broadcast(bot, channel_username, msg_id, message.chat.id, active_days)
     await message.answer(
-        f"✅ Yuborildi: {success} ta\n❌ Xatolik: {fail} ta",
+        "🚀 Habar yuborish boshlandi. Jarayon shu yerda ko‘rsatib boriladi.",
         reply_markup=admin_keyboard()
     )
 
@@ -969,7 +1061,7 @@ async def handle_code_message(message: types.Message):
     code = message.text
     unsubscribed = await get_unsubscribed_channels(message.from_user.id)
     if unsubscribed:
-        markup = await make_unsubscribed_markup(message.from_user.id, code)
+        markup = await make_unsubscribed_markup(message.from_user.id, code, unsubscribed)
         await message.answer(
             "❗ Anime olishdan oldin quyidagi kanal(lar)ga obuna bo‘ling:",
             reply_markup=markup
@@ -1022,24 +1114,160 @@ async def download_all(callback: types.CallbackQuery):
         await callback.message.answer("❌ Hech qanday qism topilmadi.")
         return
 
-    await callback.answer("⏳ Yuklanmoqda, biroz kuting...")
+    total = result.get("post_count") or len(parts_file_ids)
+    if total == 1:
+        await queue_parts(callback, code, title, kino_parts(result))
+        return
+
+    await callback.answer()
+    await callback.message.answer(
+        f"🎞 {title}\n📚 Jami: {total} qism\n\nQaysi qism(lar)ni yuboray?",
+        reply_markup=episode_picker_keyboard(code, total)
+    )
+
+
+# === Qism tanlash ===
+EPISODES_PER_PAGE = 20
+EPISODE_RANGE_SIZE = 10
+
+
+def episode_picker_keyboard(code, total, page=0):
+    """Sahifadagi qism tugmalari, 10 talik oraliqlar, oxirgi qism va navigatsiya."""
+    pages = (total + EPISODES_PER_PAGE - 1) // EPISODES_PER_PAGE
+    page = max(0, min(page, pages - 1))
+    first = page * EPISODES_PER_PAGE + 1
+    last = min(total, first + EPISODES_PER_PAGE - 1)
+
+    kb = InlineKeyboardMarkup(row_width=5)
+    kb.add(*[
+        InlineKeyboardButton(str(n), callback_data=f"ep:{code}:{n}:{n}")
+        for n in range(first, last + 1)
+    ])
+    kb.row(*[
+        InlineKeyboardButton(
+            f"{a}–{min(a + EPISODE_RANGE_SIZE - 1, last)}",
+            callback_data=f"ep:{code}:{a}:{min(a + EPISODE_RANGE_SIZE - 1, last)}"
+        )
+        for a in range(first, last + 1, EPISODE_RANGE_SIZE)
+    ])
+    if pages > 1:
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀️", callback_data=f"eppage:{code}:{page - 1}"))
+        nav.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"eppage:{code}:{page}"))
+        if page + 1 < pages:
+            nav.append(InlineKeyboardButton("▶️", callback_data=f"eppage:{code}:{page + 1}"))
+        kb.row(*nav)
+    kb.row(InlineKeyboardButton("🆕 Oxirgi qism", callback_data=f"ep:{code}:{total}:{total}"))
+    return kb
+
+
+@dp.callback_query_handler(lambda c: c.data.startswith("eppage:"))
+async def episode_page_callback(callback: types.CallbackQuery):
+    _, code, page = callback.data.split(":")
+    result = await get_kino_by_code(code)
+    if not result or not result["parts_file_ids"]:
+        await callback.answer("❌ Kod topilmadi.")
+        return
+    total = result.get("post_count") or len(result["parts_file_ids"])
+    try:
+        await callback.message.edit_reply_markup(episode_picker_keyboard(code, total, int(page)))
+    except MessageNotModified:
+        pass
+    await callback.answer()
+
+
+@dp.callback_query_handler(lambda c: c.data.startswith("ep:"))
+async def episode_send_callback(callback: types.CallbackQuery):
+    _, code, start, end = callback.data.split(":")
+    result = await get_kino_by_code(code)
+    if not result or not result["parts_file_ids"]:
+        await callback.answer("❌ Kod topilmadi.")
+        return
+    parts = kino_parts(result)
+    start = max(1, int(start))
+    end = min(len(parts), int(end))
+    if start > end:
+        await callback.answer("❌ Bunday qism yo‘q.")
+        return
+    await queue_parts(callback, code, result.get("title", "Anime"), parts[start - 1:end], start)
+
+
+# === Qismlarni albom qilib yuborish ===
+def kino_parts(result):
+    """[(file_id, turi), ...] — turi eski qismlarda None."""
+    return list(zip(result["parts_file_ids"], result["parts_kinds"]))
+
 
-    for idx, file_id in enumerate(parts_file_ids, start=1):
+async def send_part(chat_id, file_id, kind, caption, guess="video"):
+    """Turi ma’lum bo‘lsa bitta so‘rov; noma’lum bo‘lsa avval `guess`, so‘ng boshqasi."""
+    order = [kind] if kind else [guess, "document" if guess == "video" else "video"]
+    for i, attempt in enumerate(order):
+        send = bot.send_video if attempt == "video" else bot.send_document
         try:
-            caption = f"{title} [{idx}-qism]"
-            await bot.send_document(
-                chat_id=callback.from_user.id,
-                document=file_id,
-                caption=caption
-            )
-            await asyncio.sleep(0.1)  # flood control
-        except Exception as e:
-            print(f"Xatolik yuborishda {file_id}: {e}")
+            await send(chat_id, file_id, caption=caption)
+            return
+        except BadRequest:
+            if i == len(order) - 1:
+                raise
+
+
+async def send_part_group(chat_id, title, group):
+    """
+    [(raqam, (file_id, turi)), ...] ni albom qilib yuboradi: bir xil turdagi
+    ketma-ket qismlar bitta media group bo‘ladi (video va document aralashmaydi).
+    Albom yuborilmasa, undagi qismlar birma-bir yuboriladi.
+    """
+    # Turi noma’lum eski qismlar asosan video
+    for album_kind, run in groupby(group, key=lambda item: item[1][1] or "video"):
+        run = list(run)
+        guess = "video"
+        if len(run) > 1:
+            media = types.MediaGroup()
+            attach = media.attach_document if album_kind == "document" else media.attach_video
+            for idx, (file_id, _) in run:
+                attach(file_id, caption=f"{title} [{idx}-qism]")
+            try:
+                await bot.send_media_group(chat_id, media)
+                continue
+            except BadRequest as e:
+                # Noma’lum qismlar video albomga sig‘madi — demak document
+                guess = "document"
+                print(f"Albom yuborilmadi, birma-bir yuboriladi: {e}")
+            except Exception as e:
+                print(f"Albom yuborilmadi, birma-bir yuboriladi: {e}")
+        for idx, (file_id, kind) in run:
+            try:
+                await send_part(chat_id, file_id, kind, f"{title} [{idx}-qism]", guess)
+            except Exception as e:
+                print(f"Xatolik yuborishda {file_id}: {e}")
+
+
+delivery = DeliveryScheduler(send_part_group)
+
+
+async def queue_parts(callback, code, title, parts, first_number=1):
+    if delivery.submit(callback.from_user.id, code, title, parts, first_number):
+        await callback.answer("⏳ Yuklanmoqda, biroz kuting...")
+    else:
+        await callback.answer("⏳ Bu qismlar allaqachon yuborilmoqda.")
 
 # === START ===
 async def on_startup(dp):
     await init_db()
+    await load_admins(START_ADMINS)
+    asyncio.create_task(admins_listener())
+    asyncio.create_task(pool_supervisor())
+    asyncio.create_task(buffer_flusher())
+    asyncio.create_task(load_known_users())
+    asyncio.create_task(channel_info_refresher())
+    delivery.start()
+    await resume_broadcasts(bot)
     print("✅ PostgreSQL bazaga ulandi!")
 
+async def on_shutdown(dp):
+    await contest.flush()  # kutilayotgan konkurs holati diskka yozilsin
+    await close_db()
+
 if __name__ == "__main__":
-    executor.start_polling(dp, skip_updates=False, on_startup=on_startup)
+    executor.start_polling(dp, skip_updates=False, on_startup=on_startup, on_shutdown=on_shutdown)
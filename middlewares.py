@@ -0,0 +1,24 @@
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from database import touch_user
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """
+    Har bir kiruvchi xabar/callbackda foydalanuvchi faolligini belgilaydi.
+    Bazaga yozish `buffer_flusher` orqali partiyalab bo‘ladi.
+    """
+
+    def _seen(self, user: types.User, bot):
+        touch_user(user.id)
+        # Foydalanuvchi yozyapti — demak botni bloklamagan
+        breaker = getattr(bot, "breaker", None)
+        if breaker is not None:
+            breaker.reset(user.id)
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        if message.from_user and message.chat.type == types.ChatType.PRIVATE:
+            self._seen(message.from_user, message.bot)
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        self._seen(call.from_user, call.bot)
@@ -0,0 +1,306 @@
+import os
+import heapq
+import random
+import asyncio
+import itertools
+import contextvars
+import aiohttp
+from collections import Counter
+from contextlib import contextmanager
+from aiogram import Bot
+from aiogram.utils.exceptions import (
+    TelegramAPIError, RetryAfter, NetworkError, RestartingTelegram,
+    BotBlocked, BotKicked, UserDeactivated, CantInitiateConversation,
+    CantTalkWithBots, ChatNotFound,
+)
+
+# ==== USTUVORLIK SINFLARI (kichik raqam — oldin) ====
+INTERACTIVE = 0   # foydalanuvchiga javoblar
+DELIVERY = 1      # qismlarni yuborish
+CHANNEL = 2       # kanallarga postlar
+BROADCAST = 3     # ommaviy habar yuborish
+
+# ==== SOZLAMALAR ====
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "30"))              # umumiy, xabar / soniya
+PRIVATE_CHAT_RATE = float(os.getenv("PRIVATE_CHAT_RATE", "1"))      # bitta shaxsiy chatga
+PRIVATE_CHAT_BURST = int(os.getenv("PRIVATE_CHAT_BURST", "3"))
+GROUP_CHAT_RATE = float(os.getenv("GROUP_CHAT_RATE", str(20 / 60)))  # guruh / kanalga
+
+OUTBOUND_RETRIES = int(os.getenv("OUTBOUND_RETRIES", "3"))            # vaqtinchalik xatolarda
+OUTBOUND_BACKOFF = float(os.getenv("OUTBOUND_BACKOFF", "0.5"))        # soniya, har safar 2x
+OUTBOUND_MAX_RETRY_AFTER = int(os.getenv("OUTBOUND_MAX_RETRY_AFTER", "5"))
+CHAT_BREAKER_COOLDOWN = float(os.getenv("CHAT_BREAKER_COOLDOWN", str(6 * 3600)))
+FANOUT_LIMIT = int(os.getenv("FANOUT_LIMIT", "10"))                   # bir vaqtda nechta manzilga
+
+# Bu xatolardan keyin chatga qayta yozish foydasiz
+PERMANENT_ERRORS = (
+    BotBlocked, BotKicked, UserDeactivated, CantInitiateConversation,
+    CantTalkWithBots, ChatNotFound,
+)
+# Bu xatolar o‘tib ketadi — kutib qayta urinish mumkin
+TRANSIENT_ERRORS = (NetworkError, RestartingTelegram, asyncio.TimeoutError)
+
+# Telegram cheklovlari faqat xabar yuboruvchi/o‘zgartiruvchi metodlarga tegishli
+SEND_METHODS = {
+    "sendMessage", "sendPhoto", "sendVideo", "sendDocument", "sendAudio",
+    "sendAnimation", "sendVoice", "sendVideoNote", "sendSticker",
+    "sendMediaGroup", "forwardMessage", "copyMessage",
+    "editMessageText", "editMessageCaption", "editMessageMedia",
+    "editMessageReplyMarkup",
+}
+# Takror yuborilsa ham natija o‘zgarmaydi. Qolganlarida timeout bo‘lsa so‘rov
+# Telegramga yetib borgan bo‘lishi mumkin — qayta urinish dublikat beradi.
+IDEMPOTENT_METHODS = {
+    "editMessageText", "editMessageCaption", "editMessageMedia",
+    "editMessageReplyMarkup",
+}
+
+_priority = contextvars.ContextVar("outbound_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int):
+    """Blok ichidagi barcha yuborishlar shu ustuvorlik bilan navbatga turadi."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def set_priority(level: int):
+    """Joriy task uchun ustuvorlikni o‘rnatadi (ishchi tasklar boshida)."""
+    _priority.set(level)
+
+
+async def fanout(targets, send, limit: int = FANOUT_LIMIT):
+    """
+    Bitta narsani ko‘p manzilga parallel yuboradi (bir vaqtda ko‘pi bilan `limit` ta).
+    `send(target)` — coroutine. Natija kirish tartibida: [(target, natija yoki xato), ...].
+    Xatolar tashqariga chiqmaydi. Ustuvorlik (priority) chaqiruvchidan meros olinadi.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def one(target):
+        async with semaphore:
+            try:
+                return target, await send(target)
+            except Exception as e:
+                return target, e
+
+    return await asyncio.gather(*(one(target) for target in list(targets)))
+
+
+def count_results(results) -> tuple[int, int]:
+    """`fanout` natijasidan (muvaffaqiyatli, xato) sonlari."""
+    failed = sum(1 for _, result in results if isinstance(result, Exception))
+    return len(results) - failed, failed
+
+
+class ChatUnavailable(TelegramAPIError):
+    """Chat uchun circuit breaker ochiq — so‘rov Telegramga yuborilmadi."""
+
+    def __init__(self, chat_id, reason: TelegramAPIError):
+        super().__init__(f"Chat {chat_id} vaqtincha o‘chirilgan: {reason}")
+        self.chat_id = chat_id
+        self.reason = reason
+
+
+class ChatCircuitBreaker:
+    """
+    Doimiy xato (bloklangan, o‘chirilgan akkaunt va h.k.) bergan chatlarga
+    `cooldown` soniya davomida so‘rov yubormaydi. Muddat tugagach bitta
+    so‘rov o‘tkaziladi; u ham xato bersa, breaker qayta ochiladi.
+    """
+
+    def __init__(self, cooldown: float = CHAT_BREAKER_COOLDOWN):
+        self.cooldown = cooldown
+        self._open = {}  # chat -> (muddat, xato)
+
+    def check(self, chat_id):
+        key = str(chat_id)
+        entry = self._open.get(key)
+        if entry is None:
+            return
+        until, reason = entry
+        if until > asyncio.get_running_loop().time():
+            raise ChatUnavailable(chat_id, reason)
+        del self._open[key]
+
+    def trip(self, chat_id, reason: TelegramAPIError):
+        until = asyncio.get_running_loop().time() + self.cooldown
+        self._open[str(chat_id)] = (until, reason)
+
+    def reset(self, chat_id):
+        self._open.pop(str(chat_id), None)
+
+    def __len__(self):
+        return len(self._open)
+
+
+def _safe_to_retry(method: str, error: Exception) -> bool:
+    """
+    So‘rov Telegramga yetib bormaganiga ishonch bo‘lsagina qayta yuboriladi.
+    aiogram barcha aiohttp xatolarini NetworkError ga o‘raydi (asl xato
+    `__context__` da): faqat ulanish bosqichidagi xato xavfsiz, javob
+    yo‘qolgan bo‘lsa xabar allaqachon yuborilgan bo‘lishi mumkin.
+    """
+    if method in IDEMPOTENT_METHODS or isinstance(error, RestartingTelegram):
+        return True
+    return isinstance(error, NetworkError) and isinstance(error.__context__, aiohttp.ClientConnectorError)
+
+
+def _is_private(chat_id) -> bool:
+    try:
+        return int(chat_id) > 0
+    except (TypeError, ValueError):
+        return False  # "@kanal" ko‘rinishidagi username
+
+
+class SendScheduler:
+    """
+    Barcha chiquvchi xabarlar uchun umumiy navbat.
+    Avval chat bo‘yicha cheklov (GCRA, shaxsiy chatlarda kichik burst bilan),
+    so‘ng umumiy tezlik: bo‘sh joy eng yuqori ustuvorlikdagi kutuvchiga beriladi.
+    """
+
+    def __init__(self, rate=OUTBOUND_RATE, private_rate=PRIVATE_CHAT_RATE,
+                 private_burst=PRIVATE_CHAT_BURST, group_rate=GROUP_CHAT_RATE):
+        self.interval = 1 / rate
+        self.private_interval = 1 / private_rate
+        self.private_burst = private_burst
+        self.group_interval = 1 / group_rate
+        self._next = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._pump_task = None
+        self._chat_tat = {}
+
+    async def acquire(self, chat_id, level: int = INTERACTIVE):
+        if chat_id is not None:
+            await self._wait_chat(chat_id)
+        await self._wait_global(level)
+
+    def _chat_limits(self, chat_id):
+        if _is_private(chat_id):
+            return self.private_interval, self.private_burst
+        return self.group_interval, 1
+
+    async def _wait_chat(self, chat_id):
+        now = asyncio.get_running_loop().time()
+        interval, burst = self._chat_limits(chat_id)
+        key = str(chat_id)
+        tat = max(self._chat_tat.get(key, now), now)
+        self._chat_tat[key] = tat + interval
+        if len(self._chat_tat) > 10000:
+            self._chat_tat = {k: v for k, v in self._chat_tat.items() if v > now}
+        delay = tat - now - interval * (burst - 1)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _wait_global(self, level: int):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._seq), fut))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await fut
+
+    async def _pump(self):
+        loop = asyncio.get_running_loop()
+        while self._waiters:
+            now = loop.time()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():  # kutuvchi bekor qilingan
+                continue
+            fut.set_result(None)
+            self._next = max(self._next, now) + self.interval
+
+    def delay_chat(self, chat_id, seconds: float):
+        """RetryAfter: shu chatga keyingi yuborish kamida `seconds` soniyadan keyin."""
+        now = asyncio.get_running_loop().time()
+        interval, burst = self._chat_limits(chat_id)
+        key = str(chat_id)
+        # burst zaxirasi hisobga olinadi, aks holda kutish qisqarib qoladi
+        self._chat_tat[key] = max(self._chat_tat.get(key, now), now + seconds + interval * (burst - 1))
+
+    def pause(self, seconds: float):
+        """Barcha yuborishlarni `seconds` soniyaga to‘xtatadi."""
+        now = asyncio.get_running_loop().time()
+        self._next = max(self._next, now + seconds)
+
+    def stats(self) -> dict:
+        by_level = {}
+        for level, _, fut in self._waiters:
+            if not fut.done():
+                by_level[level] = by_level.get(level, 0) + 1
+        return by_level
+
+
+class OutboundBot(Bot):
+    """
+    Bot API ga yuboriladigan barcha xabarlar `SendScheduler` orqali o‘tadi:
+    main.py dagi handlerlar ham, konkurs.py ham, `message.answer` ham.
+    RetryAfter aniq ko‘rsatilgan vaqtga kutiladi, tarmoq xatolari
+    jitter bilan qayta uriniladi, o‘lik chatlar breaker bilan o‘chiriladi.
+    Fayl yuklovchi so‘rovlar qayta yuborilmaydi (fayl oqimi yopilgan bo‘ladi).
+    """
+
+    def __init__(self, *args, scheduler: SendScheduler | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler or SendScheduler()
+        self.breaker = ChatCircuitBreaker()
+        self.error_counts = Counter()
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if method not in SEND_METHODS:
+            return await super().request(method, data, files, **kwargs)
+
+        chat_id = (data or {}).get("chat_id")
+        if chat_id is not None:
+            try:
+                self.breaker.check(chat_id)
+            except ChatUnavailable:
+                self.error_counts["ChatUnavailable"] += 1
+                raise
+
+        attempt = flood = 0
+        while True:
+            await self.scheduler.acquire(chat_id, _priority.get())
+            try:
+                return await super().request(method, data, files, **kwargs)
+            except RetryAfter as e:
+                self.error_counts["RetryAfter"] += 1
+                flood += 1
+                # aiohttp yuklangan faylni birinchi urinishdan keyin yopadi
+                if files or flood > OUTBOUND_MAX_RETRY_AFTER:
+                    raise
+                if chat_id is not None:
+                    self.scheduler.delay_chat(chat_id, e.timeout)
+                else:
+                    # Chatga bog‘liq bo‘lmagan flood — butun navbat to‘xtaydi
+                    self.scheduler.pause(e.timeout)
+            except PERMANENT_ERRORS as e:
+                self.error_counts[type(e).__name__] += 1
+                if chat_id is not None:
+                    self.breaker.trip(chat_id, e)
+                raise
+            except TRANSIENT_ERRORS as e:
+                self.error_counts[type(e).__name__] += 1
+                attempt += 1
+                if files or attempt > OUTBOUND_RETRIES or not _safe_to_retry(method, e):
+                    raise
+                delay = OUTBOUND_BACKOFF * 2 ** (attempt - 1)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            except TelegramAPIError as e:
+                self.error_counts[type(e).__name__] += 1
+                raise
+
+    def stats(self) -> dict:
+        return {
+            "errors": dict(self.error_counts),
+            "open_chats": len(self.breaker),
+            "waiting": self.scheduler.stats(),
+        }